@@ -0,0 +1,55 @@
+# -*- coding: utf-8; -*-
+
+"""
+The former regex based prototype extraction of `ino preproc', kept as
+a baseline for bench/preproc.py.
+"""
+
+import re
+
+
+def prototypes(src):
+    src = collapse_braces(strip(src))
+    regex = re.compile("[\\w\\[\\]\\*]+\\s+[&\\[\\]\\*\\w\\s]+\\([&,\\[\\]\\*\\w\\s]*\\)(?=\\s*\\{)")
+    matches = regex.findall(src)
+    return [m + ';' for m in matches]
+
+
+def collapse_braces(src):
+    """
+    Remove the contents of all top-level curly brace pairs {}.
+    """
+    result = []
+    nesting = 0;
+
+    for c in src:
+        if not nesting:
+            result.append(c)
+        if c == '{':
+            nesting += 1
+        elif c == '}':
+            nesting -= 1
+            result.append(c)
+
+    return ''.join(result)
+
+
+def strip(src):
+    """
+    Strips comments, pre-processor directives, single- and double-quoted
+    strings from a string.
+    """
+    # single-quoted character
+    p = "('.')"
+
+    # double-quoted string
+    p += "|(\"(?:[^\"\\\\]|\\\\.)*\")"
+
+    # single and multi-line comment
+    p += "|(//.*?$)|(/\\*[^*]*(?:\\*(?!/)[^*]*)*\\*/)"
+
+    # pre-processor directive
+    p += "|" + "(^\\s*#.*?$)"
+
+    regex = re.compile(p, re.MULTILINE)
+    return regex.sub(' ', src)
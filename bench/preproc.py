@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; -*-
+
+"""
+Measure throughput of prototype extraction of sketch preprocessing,
+comparing ino.sketch with the former regex based implementation kept in
+bench/legacy_preproc.py.
+
+Sketches are generated with several kinds of content:
+
+  functions  many small functions
+  tables     large PROGMEM lookup tables
+  assets     embedded assets as long string literals
+  comments   large commented out blocks
+
+Example:
+
+    python bench/preproc.py --size 500 --repeat 3
+"""
+
+import os.path
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ino.sketch
+import legacy_preproc
+
+from run import median
+
+
+def function(i):
+    return ('// returns a value\n'
+            'int function%d(int a, char *b) {\n'
+            '  if (a > %d) {\n'
+            '    return b[a] + \'{\';\n'
+            '  }\n'
+            '  return a;\n'
+            '}\n\n' % (i, i))
+
+
+def table(i):
+    rows = ['  ' + ', '.join('0x%02X' % ((i + j) & 0xff) for j in range(16)) + ',\n'
+            for r in range(64)]
+    return 'const unsigned char table%d[] PROGMEM = {\n%s};\n\n' % (i, ''.join(rows))
+
+
+def asset(i):
+    line = '<div class=\\"row\\">{{ value }} (%d)</div>' % i
+    return 'const char asset%d[] PROGMEM = "%s";\n\n' % (i, line * 200)
+
+
+def comment(i):
+    body = ''.join('  void disabled%d_%d(int x) { x++; }\n' % (i, j) for j in range(100))
+    return '/*\n%s*/\n\n' % body
+
+
+generators = {
+    'functions': function,
+    'tables': table,
+    'assets': asset,
+    'comments': comment,
+}
+
+
+def generate(kind, size):
+    parts = ['#include <avr/pgmspace.h>\n\nvoid setup() {}\n\n']
+    length = len(parts[0])
+    i = 0
+    while length < size:
+        parts.append(generators[kind](i))
+        length += len(parts[-1])
+        i += 1
+    parts.append('void loop() {}\n')
+    return ''.join(parts)
+
+
+def measure(f, sketch, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        result = f(sketch)
+        times.append(time.time() - start)
+    return median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=200, help='Sketch size in KB')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of every implementation')
+    parser.add_argument('--kind', action='append', choices=sorted(generators),
+                        help='Kind of sketch content, may be repeated (default: all)')
+    args = parser.parse_args()
+
+    print '%-10s %8s %10s %10s %10s %10s  %s' % ('kind', 'size', 'legacy', 'MB/s',
+                                                  'tokenizer', 'MB/s', 'prototypes')
+    for kind in args.kind or sorted(generators):
+        sketch = generate(kind, args.size * 1024)
+        mb = len(sketch) / 1e6
+        legacy_time, legacy_result = measure(legacy_preproc.prototypes, sketch, args.repeat)
+        new_time, new_result = measure(ino.sketch.prototypes, sketch, args.repeat)
+        same = 'same' if legacy_result == new_result else 'DIFFERENT'
+        print '%-10s %7dK %9.3fs %10.1f %9.3fs %10.1f  %d, %s' % (
+            kind, len(sketch) // 1024, legacy_time, mb / legacy_time,
+            new_time, mb / new_time, len(new_result), same)
+
+
+if __name__ == '__main__':
+    main()
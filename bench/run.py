@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; -*-
+
+"""
+Measure overhead of ino on a synthetic project built with a stub AVR
+toolchain.
+
+Scenarios:
+  cold         build from scratch with empty build dir and user caches
+  noop         build of an up to date project
+  touch        build after a change of a single project source
+  list-models  ino list-models
+  preproc      ino preproc of the main sketch
+
+Example:
+
+    python bench/run.py --sources 50 --libs 8 --repeat 5 -- --engine=native
+
+Arguments after `--' are passed to `ino build'. Results could be appended
+to a JSON lines file with --output to track them over time.
+"""
+
+import os
+import os.path
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+import synth
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Bench(object):
+
+    def __init__(self, args, work_dir):
+        self.args = args
+        self.work_dir = work_dir
+        self.dist_dir = os.path.join(work_dir, 'arduino')
+        self.project_dir = os.path.join(work_dir, 'project')
+        self.cache_dir = os.path.join(work_dir, 'cache')
+
+        # isolate from ~/.inorc and user caches of the real user
+        self.env = dict(os.environ)
+        self.env.update({
+            'HOME': work_dir,
+            'XDG_CACHE_HOME': self.cache_dir,
+            'PYTHONPATH': os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+        })
+
+    def generate(self):
+        a = self.args
+        synth.make_dist(self.dist_dir, std_libs=a.std_libs, lib_sources=a.lib_sources)
+        synth.make_project(self.project_dir, sketches=a.sketches, sources=a.sources,
+                           headers=a.headers, libs=a.libs, lib_sources=a.lib_sources,
+                           std_libs=a.std_libs)
+
+    def ino(self, *args):
+        command = [sys.executable, os.path.join(ROOT, 'bin', 'ino')] + list(args)
+        start = time.time()
+        proc = subprocess.Popen(command, cwd=self.project_dir, env=self.env,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        elapsed = time.time() - start
+        if proc.returncode != 0:
+            sys.stderr.write(output)
+            raise SystemExit('Command failed: ' + ' '.join(command))
+        return elapsed
+
+    def build(self):
+        return self.ino('build', '-d', self.dist_dir, *self.args.build_args)
+
+    def clean(self):
+        for d in [os.path.join(self.project_dir, '.build'), self.cache_dir]:
+            if os.path.isdir(d):
+                shutil.rmtree(d)
+
+    def scenario_cold(self):
+        self.clean()
+        return self.build()
+
+    def scenario_noop(self):
+        return self.build()
+
+    def scenario_touch(self):
+        path = os.path.join(self.project_dir, 'src', 'source0.cpp')
+        with open(path, 'a') as f:
+            f.write('// changed at %f\n' % time.time())
+        return self.build()
+
+    def scenario_list_models(self):
+        return self.ino('list-models', '-d', self.dist_dir)
+
+    def scenario_preproc(self):
+        return self.ino('preproc', '-d', self.dist_dir, '-o', os.devnull,
+                        os.path.join('src', 'sketch.ino'))
+
+    scenarios = ['cold', 'noop', 'touch', 'list-models', 'preproc']
+
+    def run(self, scenario):
+        method = getattr(self, 'scenario_' + scenario.replace('-', '_'))
+        if scenario in ('noop', 'touch'):
+            # make sure there is something to be up to date with
+            self.build()
+        # mtime resolution of some file systems is a second
+        time.sleep(self.args.settle)
+        return [method() for i in range(self.args.repeat)]
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def git_revision():
+    try:
+        return subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE).communicate()[0].strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sketches', type=int, default=1, help='Number of sketch files')
+    parser.add_argument('--sources', type=int, default=20, help='Number of project sources')
+    parser.add_argument('--headers', type=int, default=20, help='Number of project headers')
+    parser.add_argument('--libs', type=int, default=4, help='Number of project libraries')
+    parser.add_argument('--std-libs', type=int, default=4, help='Number of standard libraries')
+    parser.add_argument('--lib-sources', type=int, default=3, help='Number of sources per library')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of every scenario')
+    parser.add_argument('--settle', type=float, default=1.0,
+                        help='Seconds to wait before every scenario')
+    parser.add_argument('--scenario', action='append', choices=Bench.scenarios,
+                        help='Scenario to run, may be repeated (default: all)')
+    parser.add_argument('--work-dir', help='Directory for generated files (default: temporary)')
+    parser.add_argument('--output', help='Append results to this JSON lines file')
+    parser.add_argument('build_args', nargs='*', help='Extra arguments of ino build')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='ino-bench-')
+    bench = Bench(args, work_dir)
+    try:
+        bench.generate()
+        results = {}
+        print '%-12s %9s %9s %9s' % ('scenario', 'min', 'median', 'max')
+        for scenario in args.scenario or Bench.scenarios:
+            times = bench.run(scenario)
+            results[scenario] = times
+            print '%-12s %8.3fs %8.3fs %8.3fs' % (scenario, min(times), median(times), max(times))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+
+    if args.output:
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': sys.version.split()[0],
+            'params': dict((k, getattr(args, k)) for k in
+                           ['sketches', 'sources', 'headers', 'libs', 'std_libs',
+                            'lib_sources', 'repeat', 'build_args']),
+            'results': results,
+        }
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; -*-
+
+"""
+Measure startup time of ino: run `ino --help' and `ino <command> --help'
+for every command in fresh processes and fail if the median time of any
+of them is over the budget.
+
+Example:
+
+    python bench/startup.py --repeat 10 --budget 0.15
+
+Time of a bare interpreter start is printed for reference. The ino
+server is not used.
+"""
+
+import os
+import os.path
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ino.commands
+
+from run import median
+
+
+def measure(command, env, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        proc = subprocess.Popen(command, env=env, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        times.append(time.time() - start)
+        if proc.returncode != 0:
+            sys.stderr.write(output)
+            raise SystemExit('Command failed: ' + ' '.join(command))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of every command')
+    parser.add_argument('--budget', type=float, default=0.2,
+                        help='Maximum median time of a command in seconds (default: %(default)s)')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='ino-startup-')
+    # isolate from ~/.inorc and user caches of the real user
+    env = dict(os.environ)
+    env.update({
+        'HOME': work_dir,
+        'XDG_CACHE_HOME': os.path.join(work_dir, 'cache'),
+        'PYTHONPATH': os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+        'INO_NO_SERVER': '1',
+    })
+    ino_bin = [sys.executable, os.path.join(ROOT, 'bin', 'ino')]
+
+    commands = [('python', [sys.executable, '-c', 'pass'])]
+    commands.append(('--help', ino_bin + ['--help']))
+    for info in ino.commands.registry:
+        commands.append((info.name + ' --help', ino_bin + [info.name, '--help']))
+
+    over = []
+    try:
+        print '%-20s %9s %9s %9s' % ('command', 'min', 'median', 'max')
+        for name, command in commands:
+            times = measure(command, env, args.repeat)
+            status = ''
+            if name != 'python' and median(times) > args.budget:
+                over.append(name)
+                status = '  over budget'
+            print '%-20s %8.3fs %8.3fs %8.3fs%s' % (name, min(times), median(times),
+                                                   max(times), status)
+    finally:
+        shutil.rmtree(work_dir)
+
+    if over:
+        raise SystemExit('Startup time is over the budget of %.3fs for: %s' %
+                         (args.budget, ', '.join(over)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+# -*- coding: utf-8; -*-
+
+"""
+Generators of synthetic Arduino projects and a fake Arduino distribution
+with a stub AVR toolchain. The stub tools only create their output files
+so that timings of a build show overhead of ino itself rather than of
+the compiler.
+"""
+
+import os
+import os.path
+import stat
+
+
+BOARDS_TXT = """\
+##############################################################
+
+uno.name=Arduino Uno
+uno.upload.protocol=arduino
+uno.upload.maximum_size=32256
+uno.upload.speed=115200
+uno.bootloader.low_fuses=0xff
+uno.bootloader.high_fuses=0xde
+uno.bootloader.extended_fuses=0x05
+uno.bootloader.path=optiboot
+uno.bootloader.file=optiboot_atmega328.hex
+uno.bootloader.unlock_bits=0x3F
+uno.bootloader.lock_bits=0x0F
+uno.build.mcu=atmega328p
+uno.build.f_cpu=16000000L
+uno.build.core=arduino
+uno.build.variant=standard
+
+##############################################################
+
+mega2560.name=Arduino Mega 2560 or Mega ADK
+mega2560.upload.protocol=wiring
+mega2560.upload.maximum_size=258048
+mega2560.upload.speed=115200
+mega2560.bootloader.low_fuses=0xFF
+mega2560.bootloader.high_fuses=0xD8
+mega2560.bootloader.extended_fuses=0xFD
+mega2560.bootloader.path=stk500v2
+mega2560.bootloader.file=stk500boot_v2_mega2560.hex
+mega2560.bootloader.unlock_bits=0x3F
+mega2560.bootloader.lock_bits=0x0F
+mega2560.build.mcu=atmega2560
+mega2560.build.f_cpu=16000000L
+mega2560.build.core=arduino
+mega2560.build.variant=mega
+"""
+
+# Creates the file given with -o (or the last argument for ar and
+# objcopy). Preprocessing with -E prints the source, so that the object
+# cache gets distinct keys for distinct sources.
+STUB_CC = """\
+#!/bin/sh
+out=
+src=
+prev=
+preprocess=
+for arg in "$@"; do
+    if [ "$prev" = "-o" ]; then
+        out=$arg
+    else
+        case "$arg" in
+            -E) preprocess=1 ;;
+            -*) ;;
+            *) src=$arg ;;
+        esac
+    fi
+    prev=$arg
+done
+if [ -n "$preprocess" ]; then
+    exec cat "$src"
+fi
+if [ -n "$out" ]; then
+    echo "$src" > "$out"
+fi
+"""
+
+STUB_AR = """\
+#!/bin/sh
+shift
+out=$1
+shift
+cat "$@" > "$out"
+"""
+
+STUB_OBJCOPY = """\
+#!/bin/sh
+for arg in "$@"; do out=$arg; done
+echo ':00000001FF' > "$out"
+"""
+
+
+def write_file(path, contents, executable=False):
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'w') as f:
+        f.write(contents)
+    if executable:
+        mode = os.stat(path).st_mode
+        os.chmod(path, mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def header(name, includes=()):
+    guard = name.upper().replace('.', '_').replace('/', '_')
+    lines = ['#ifndef %s' % guard, '#define %s' % guard, '']
+    lines += ['#include "%s"' % inc for inc in includes]
+    lines += ['', 'int %s_value();' % guard.lower(), '', '#endif', '']
+    return '\n'.join(lines)
+
+
+def library_name(i):
+    return 'Lib%d' % i
+
+
+def std_library_name(i):
+    return 'StdLib%d' % i
+
+
+def make_library(lib_dir, name, deps, sources):
+    """
+    Create a library consisting of `sources' .cpp files, a public header
+    including headers of libraries listed in `deps', and a private
+    header in `utility' subdirectory.
+    """
+    includes = ['%s.h' % dep for dep in deps]
+    write_file(os.path.join(lib_dir, name + '.h'),
+               header(name + '.h', ['Arduino.h'] + includes))
+    write_file(os.path.join(lib_dir, 'utility', 'impl.h'), header(name + '/impl.h'))
+    for i in range(sources):
+        write_file(os.path.join(lib_dir, '%s%d.cpp' % (name, i)),
+                   '#include "%s.h"\n#include "utility/impl.h"\n\n'
+                   'int %s_%d() { return %d; }\n' % (name, name, i, i))
+
+
+def make_dist(path, std_libs=4, lib_sources=2, version='1.0'):
+    """
+    Create a fake Arduino distribution at `path' with `std_libs' standard
+    libraries and the stub toolchain in hardware/tools/avr/bin.
+    """
+    write_file(os.path.join(path, 'lib', 'version.txt'), version + '\n')
+
+    hardware = os.path.join(path, 'hardware')
+    write_file(os.path.join(hardware, 'arduino', 'boards.txt'), BOARDS_TXT)
+
+    core = os.path.join(hardware, 'arduino', 'cores', 'arduino')
+    write_file(os.path.join(core, 'Arduino.h'),
+               header('Arduino.h', ['pins_arduino.h', 'wiring.h']))
+    write_file(os.path.join(core, 'wiring.h'), header('wiring.h'))
+    for name in ['main.cpp', 'wiring.c', 'wiring_digital.c', 'HardwareSerial.cpp', 'Print.cpp']:
+        write_file(os.path.join(core, name), '#include "Arduino.h"\n')
+
+    for variant in ['standard', 'mega']:
+        write_file(os.path.join(hardware, 'arduino', 'variants', variant, 'pins_arduino.h'),
+                   header('pins_arduino.h'))
+
+    bin_dir = os.path.join(hardware, 'tools', 'avr', 'bin')
+    for name in ['avr-gcc', 'avr-g++']:
+        write_file(os.path.join(bin_dir, name), STUB_CC, executable=True)
+    write_file(os.path.join(bin_dir, 'avr-ar'), STUB_AR, executable=True)
+    write_file(os.path.join(bin_dir, 'avr-objcopy'), STUB_OBJCOPY, executable=True)
+
+    for i in range(std_libs):
+        # every standard library depends on the previous one
+        deps = [std_library_name(i - 1)] if i else []
+        make_library(os.path.join(path, 'libraries', std_library_name(i)),
+                     std_library_name(i), deps, lib_sources)
+
+
+def make_project(path, sketches=1, sources=10, headers=10, libs=4, lib_sources=2, std_libs=4):
+    """
+    Create a project at `path' with `sketches' sketch files, `sources'
+    .cpp files and `headers' headers in src/ and `libs' libraries in lib/.
+
+    Every source includes a few of the project headers, the main sketch
+    includes all project libraries and standard libraries.
+    """
+    src_dir = os.path.join(path, 'src')
+    for i in range(headers):
+        includes = ['header%d.h' % (i - 1)] if i else []
+        write_file(os.path.join(src_dir, 'header%d.h' % i), header('header%d.h' % i, includes))
+
+    for i in range(sources):
+        includes = ['header%d.h' % j for j in range(i % max(headers, 1), headers, 3)][:3]
+        write_file(os.path.join(src_dir, 'source%d.cpp' % i),
+                   ''.join('#include "%s"\n' % inc for inc in includes) +
+                   '\nint source_%d() { return %d; }\n' % (i, i))
+
+    for i in range(libs):
+        deps = [library_name(i - 1)] if i else []
+        if std_libs:
+            deps.append(std_library_name(i % std_libs))
+        make_library(os.path.join(path, 'lib', library_name(i)), library_name(i), deps, lib_sources)
+
+    includes = ['%s.h' % library_name(i) for i in range(libs)]
+    includes += ['%s.h' % std_library_name(i) for i in range(std_libs)]
+    if headers:
+        includes.append('header%d.h' % (headers - 1))
+    sketch = ''.join('#include <%s>\n' % inc for inc in includes)
+    sketch += '\nvoid setup()\n{\n}\n\nvoid loop()\n{\n}\n'
+    write_file(os.path.join(src_dir, 'sketch.ino'), sketch)
+
+    for i in range(1, sketches):
+        write_file(os.path.join(src_dir, 'sketch%d.ino' % i),
+                   'void helper%d(int x)\n{\n}\n\nint value%d()\n{\n    return %d;\n}\n' % (i, i, i))
@@ -0,0 +1,206 @@
+# -*- coding: utf-8; -*-
+
+"""
+Compiled index of boards.txt.
+
+Parsing boards.txt of a distribution with many cores takes a while, so
+it is done once per machine. The index is a file in the per-user cache
+named after the path of boards.txt: a JSON header line with fingerprint
+and digest of boards.txt and (model, name, offset, length) of every
+model, followed by JSON settings of the models. The index is read at
+once, since another process may rewrite it any time, but settings of
+a model are parsed only when it is used.
+"""
+
+import os
+import os.path
+import json
+import hashlib
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python < 2.7
+    from ordereddict import OrderedDict
+
+from ino.trace import tracer
+from ino.utils import user_cache_dir, utf8_dict, format_available_options
+
+
+index_version = 1
+
+
+def decode_boards_txt(contents):
+    """
+    Return contents of boards.txt as unicode. It should be UTF-8, but
+    older third party ones are often Latin-1.
+    """
+    try:
+        return contents.decode('utf-8')
+    except UnicodeDecodeError:
+        return contents.decode('latin-1')
+
+
+def parse_boards_txt(contents):
+    """
+    Parse boards.txt into an ordered dict of model -> nested dict of
+    settings, e.g. {'uno': {'name': ..., 'build': {'mcu': ...}}}.
+    """
+    models = OrderedDict()
+    for line in decode_boards_txt(contents).splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        multikey, val = line.split('=', 1)
+        multikey = multikey.split('.')
+
+        subdict = models
+        for key in multikey[:-1]:
+            if key not in subdict:
+                subdict[key] = {}
+            subdict = subdict[key]
+
+        subdict[multikey[-1]] = val
+    return models
+
+
+def index_filepath(boards_txt):
+    key = hashlib.md5(os.path.abspath(boards_txt)).hexdigest()
+    return user_cache_dir('boards', key + '.index')
+
+
+def compile_index(boards_txt, contents, digest):
+    """
+    Return contents of an index for boards.txt.
+    """
+    models = parse_boards_txt(contents)
+    entries = []
+    chunks = []
+    offset = 0
+    for key, settings in models.iteritems():
+        chunk = json.dumps(settings)
+        entries.append([key, settings.get('name', key), offset, len(chunk)])
+        chunks.append(chunk)
+        offset += len(chunk)
+
+    st = os.stat(boards_txt)
+    header = {
+        'version': index_version,
+        'path': os.path.abspath(boards_txt),
+        'fingerprint': [st.st_mtime, st.st_size],
+        'md5': digest,
+        'models': entries,
+    }
+    return json.dumps(header) + '\n' + ''.join(chunks)
+
+
+def write_index(filepath, data):
+    dirname = os.path.dirname(filepath)
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_filepath = '%s.%d' % (filepath, os.getpid())
+        with open(tmp_filepath, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_filepath, filepath)
+    except (IOError, OSError):
+        # the index is just a speedup
+        pass
+
+
+def read_header(f):
+    try:
+        header = json.loads(f.readline(), object_hook=utf8_dict)
+    except ValueError:
+        return None
+    if header.get('version') != index_version:
+        return None
+    return header
+
+
+# path of boards.txt -> (fingerprint, BoardModels) loaded by this process,
+# e.g. by the server before forking requests
+_loaded = {}
+
+
+def load_board_models(boards_txt, default):
+    """
+    Return BoardModels of boards.txt using the machine-wide index, which
+    is compiled again if boards.txt changed. Board models loaded already
+    by the process are reused while boards.txt is unchanged.
+    """
+    st = os.stat(boards_txt)
+    key = os.path.abspath(boards_txt)
+    loaded = _loaded.get(key)
+    if loaded and loaded[0] == (st.st_mtime, st.st_size) and loaded[1].default == default:
+        return loaded[1]
+
+    filepath = index_filepath(boards_txt)
+    try:
+        with open(filepath, 'rb') as f:
+            header = read_header(f)
+            body = f.read()
+    except IOError:
+        header = None
+
+    if header and header['fingerprint'] != [st.st_mtime, st.st_size]:
+        # boards.txt was touched or replaced, compare the contents
+        with open(boards_txt, 'rb') as f:
+            contents = f.read()
+        digest = hashlib.md5(contents).hexdigest()
+        if digest != header['md5']:
+            header = None
+        else:
+            header['fingerprint'] = [st.st_mtime, st.st_size]
+            write_index(filepath, json.dumps(header) + '\n' + body)
+
+    if header is None:
+        with open(boards_txt, 'rb') as f:
+            contents = f.read()
+        with tracer.phase('parse boards.txt'):
+            data = compile_index(boards_txt, contents, hashlib.md5(contents).hexdigest())
+        write_index(filepath, data)
+        header_line, sep, body = data.partition('\n')
+        header = json.loads(header_line, object_hook=utf8_dict)
+
+    models = BoardModels(header['models'], default, body)
+    _loaded[key] = ((st.st_mtime, st.st_size), models)
+    return models
+
+
+class BoardModels(object):
+    """
+    Board models described in boards.txt: a read-only mapping of model
+    key -> nested dict of its settings. Settings of a model are parsed from
+    the body of the index when the model is looked up for the first time.
+    """
+
+    def __init__(self, entries, default, body):
+        self.entries = OrderedDict((key, (name, offset, length))
+                                   for key, name, offset, length in entries)
+        self.default = default
+        self.body = body
+        self.loaded = {}
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def __getitem__(self, key):
+        if key not in self.loaded:
+            name, offset, length = self.entries[key]
+            chunk = self.body[offset:offset + length]
+            self.loaded[key] = json.loads(chunk, object_hook=utf8_dict)
+        return self.loaded[key]
+
+    def format(self):
+        map = [(key, name) for key, (name, offset, length) in self.entries.iteritems()]
+        return format_available_options(map, head_width=12, default=self.default)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import re
+import json
+import fcntl
+import hashlib
+import shutil
+import threading
+
+from ino.engine import run_command
+from ino.utils import user_cache_dir
+from ino.exc import Abort
+
+
+def parse_size(s):
+    """
+    Parse size like `500M', `2G' or plain number of bytes.
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?\s*$', str(s), re.IGNORECASE)
+    if not match:
+        raise Abort("Could not parse size: %s" % s)
+    num, unit = match.groups()
+    return int(float(num) * 1024 ** ' KMG'.index(unit.upper() or ' '))
+
+
+def format_size(n):
+    n = float(n)
+    for unit in ['bytes', 'KB', 'MB']:
+        if n < 1024:
+            return '%.1f %s' % (n, unit)
+        n /= 1024
+    return '%.1f GB' % n
+
+
+_tool_identities = {}
+
+def tool_identity(tool):
+    """
+    Return a string identifying a tool binary: its real path, size and mtime.
+    """
+    if tool not in _tool_identities:
+        path = os.path.realpath(tool)
+        st = os.stat(path)
+        _tool_identities[tool] = '%s:%d:%d' % (path, st.st_size, st.st_mtime)
+    return _tool_identities[tool]
+
+
+class ObjectCache(object):
+    """
+    Content-addressed cache of compiled objects shared by all projects
+    and build directories, similar to ccache.
+
+    An object is looked up by a digest of the preprocessed source, the
+    full list of compiler flags and the compiler binary identity (its
+    real path, size and mtime). Directory of the build is not a part of
+    the key, so identical core and library sources compiled by different
+    projects share cache entries. Debug information would record the
+    working directory of the compiler, so it is mapped to `.' when
+    compiling a cached object.
+
+    When the cache grows over `max_size' least recently used entries are
+    evicted.
+    """
+
+    version = '3'
+    default_max_size = '1G'
+
+    def __init__(self, cache_dir=None, max_size=None):
+        self.cache_dir = cache_dir or user_cache_dir('objects')
+        self.max_size = parse_size(max_size or self.default_max_size)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # runs the compiler on a miss, could be replaced to compile remotely
+        self.run = run_command
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key[2:])
+
+    def key(self, flags, preprocessed):
+        h = hashlib.md5()
+        h.update(self.version + '\0')
+        h.update(tool_identity(flags[0]) + '\0')
+        h.update('\0'.join(flags[1:]) + '\0')
+        h.update(preprocessed)
+        return h.hexdigest()
+
+    def _count(self, attr):
+        with self.lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def compile(self, target):
+        """
+        Runner for compile targets of the native build engine. The target
+        command is expected to end with `-o <object> -c <source>'.
+        """
+        flags, obj, source = target.command[:-4], target.command[-3], target.command[-1]
+        command = target.command
+        if any(f.startswith('-g') and f != '-g0' for f in flags[1:]):
+            # keep DW_AT_comp_dir of the object the same in every project
+            command = flags + ['-fdebug-prefix-map=%s=.' % os.getcwd()] + command[-4:]
+
+        # without the working directory line the preprocessor emits for
+        # debug information
+        code, preprocessed = run_command(flags + ['-fno-working-directory', '-E', source])
+        if code != 0:
+            # let the real compiler run report errors
+            return self.run(command)
+
+        entry = self.entry_path(self.key(flags, preprocessed))
+        if os.path.exists(entry + '.o'):
+            try:
+                shutil.copyfile(entry + '.o', obj)
+                os.utime(entry + '.o', None)
+                output = ''
+                if os.path.exists(entry + '.txt'):
+                    output = open(entry + '.txt').read()
+                self._count('hits')
+                return 0, output
+            except (IOError, OSError):
+                # evicted by a concurrent process
+                pass
+
+        self._count('misses')
+        code, output = self.run(command)
+        if code == 0:
+            self.store(entry, obj, output)
+        return code, output
+
+    def store(self, entry, obj, output):
+        dirname = os.path.dirname(entry)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                pass
+
+        # other processes may read the entry at the same time
+        tmp = '%s.%d.%d' % (entry, os.getpid(), threading.current_thread().ident)
+        if output:
+            with open(tmp, 'wb') as f:
+                f.write(output)
+            os.rename(tmp, entry + '.txt')
+        shutil.copyfile(obj, tmp)
+        os.rename(tmp, entry + '.o')
+
+    def entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for subdir in os.listdir(self.cache_dir):
+            subdir = os.path.join(self.cache_dir, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                path = os.path.join(subdir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st
+
+    def size(self):
+        return sum(st.st_size for path, st in self.entries())
+
+    def cleanup(self):
+        """
+        Evict least recently used entries until size of the cache gets
+        below 90% of the limit.
+        """
+        entries = list(self.entries())
+        total = sum(st.st_size for path, st in entries)
+        if total <= self.max_size:
+            return
+        entries.sort(key=lambda entry: entry[1].st_mtime)
+        for path, st in entries:
+            if total <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= st.st_size
+
+    @property
+    def stats_filepath(self):
+        return os.path.join(self.cache_dir, 'stats')
+
+    def stats(self):
+        try:
+            with open(self.stats_filepath) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {'hits': 0, 'misses': 0}
+
+    def flush(self):
+        """
+        Add hits and misses of this run to persistent statistics and evict
+        old entries if objects were added.
+        """
+        if not self.hits and not self.misses:
+            return
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        with open(os.path.join(self.cache_dir, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            stats = self.stats()
+            stats['hits'] += self.hits
+            stats['misses'] += self.misses
+            with open(self.stats_filepath, 'w') as f:
+                json.dump(stats, f)
+
+        if self.misses:
+            self.cleanup()
+        self.hits = self.misses = 0
+
+    def clear(self):
+        if os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8; -*-
+
+"""
+Minimal client of the ino server (see `ino server --help').
+
+It is imported by bin/ino before anything else, so it should depend
+on the standard library only.
+"""
+
+import os
+import sys
+import json
+import stat
+import errno
+import signal
+import socket
+
+
+# commands which are run by the server if it is running
+served_commands = ['build', 'preproc', 'list-models']
+
+# sent by the server after the output of a command
+exit_marker = '\0ino-exit:'
+
+
+def socket_path():
+    """
+    Return path of the per-user server socket.
+    """
+    base = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(base, 'ino-%d' % os.getuid(), 'server.sock')
+
+
+def is_private(path, directory=False):
+    """
+    Tell if `path' is owned by the current user and is not a symlink. A
+    directory should also be accessible by its owner only.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if st.st_uid != os.getuid() or stat.S_ISLNK(st.st_mode):
+        return False
+    if directory:
+        return stat.S_ISDIR(st.st_mode) and stat.S_IMODE(st.st_mode) == 0700
+    return True
+
+
+def connect(path=None):
+    """
+    Return a socket connected to the server or None if it is not running.
+    A socket which is not private to the current user is never used, see
+    is_private().
+    """
+    path = path or socket_path()
+    if not os.path.exists(path):
+        return None
+    if not is_private(os.path.dirname(path), directory=True) or not is_private(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+
+def request(sock, message):
+    sock.sendall(json.dumps(message) + '\n')
+
+
+def interrupt(pid, sig):
+    # the command runs in its own process group on the server
+    try:
+        os.killpg(pid, sig)
+    except OSError:
+        pass
+
+
+def run(argv):
+    """
+    Run an ino command on the server streaming its output to stdout.
+    Return exit code of the command or None if the command should be run
+    in the current process.
+    """
+    if len(argv) < 2 or argv[1] not in served_commands or os.environ.get('INO_NO_SERVER'):
+        return None
+    sock = connect()
+    if sock is None:
+        return None
+
+    try:
+        request(sock, {
+            'argv': argv[1:],
+            'cwd': os.getcwd(),
+            # the command should run as if it was run here, the socket
+            # is private to the user anyway
+            'env': dict(os.environ),
+            'tty': sys.stdout.isatty(),
+        })
+        f = sock.makefile('rb', 0)
+        header = f.readline()
+        if not header:
+            return None
+        pid = int(header)
+    except (socket.error, ValueError):
+        return None
+
+    out = sys.stdout
+    pending = ''
+    try:
+        while True:
+            data = sock.recv(64 * 1024)
+            if not data:
+                break
+            # hold back everything from the last NUL which may start
+            # the exit marker
+            pending += data
+            nul = pending.rfind('\0')
+            if nul == -1:
+                out.write(pending)
+                pending = ''
+            else:
+                out.write(pending[:nul])
+                pending = pending[nul:]
+            out.flush()
+    except KeyboardInterrupt:
+        interrupt(pid, signal.SIGINT)
+        return 130
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            raise
+        # output is closed, e.g. by `head'
+        interrupt(pid, signal.SIGTERM)
+        return 1
+    finally:
+        sock.close()
+
+    if pending.startswith(exit_marker):
+        try:
+            return int(pending[len(exit_marker):])
+        except ValueError:
+            pass
+    out.write(pending)
+    out.write('Connection to ino server lost\n')
+    return 1
@@ -1,9 +1,62 @@
 # -*- coding: utf-8; -*-
 
-from ino.commands.init import Init
-from ino.commands.preproc import Preprocess
-from ino.commands.build import Build
-from ino.commands.clean import Clean
-from ino.commands.upload import Upload
-from ino.commands.serial import Serial
-from ino.commands.listmodels import ListModels
+"""
+Registry of ino commands.
+
+Command modules pull in heavy dependencies (jinja2, pyserial, ...), so
+only the module of the command being run is imported. Everything needed
+to list commands in `ino --help' is kept here. A new command should be
+added to `registry' and its help line kept the same as `help_line' of
+its class.
+"""
+
+from collections import namedtuple
+
+
+class CommandInfo(namedtuple('CommandInfo', 'name module class_name help_line')):
+
+    def load(self):
+        """
+        Import the command module and return the command class.
+        """
+        module = __import__(self.module, fromlist=[self.class_name])
+        return getattr(module, self.class_name)
+
+
+registry = [
+    CommandInfo('build', 'ino.commands.build', 'Build',
+                "Build firmware from the current directory project"),
+    CommandInfo('cache', 'ino.commands.cache', 'Cache',
+                "Inspect or clear the object cache"),
+    CommandInfo('clean', 'ino.commands.clean', 'Clean',
+                "Remove intermediate compilation files completely"),
+    CommandInfo('init', 'ino.commands.init', 'Init',
+                "Setup a new project in the current directory"),
+    CommandInfo('list-models', 'ino.commands.listmodels', 'ListModels',
+                "List supported Arduino board models"),
+    CommandInfo('preproc', 'ino.commands.preproc', 'Preprocess',
+                "Transform sketch files into valid C++ sources"),
+    CommandInfo('serial', 'ino.commands.serial', 'Serial',
+                "Open a serial monitor"),
+    CommandInfo('server', 'ino.commands.server', 'Server',
+                "Start or stop the background ino server"),
+    CommandInfo('upload', 'ino.commands.upload', 'Upload',
+                "Upload built firmware to the device"),
+    CommandInfo('worker', 'ino.commands.worker', 'Worker',
+                "Serve compile jobs for distributed builds"),
+]
+
+
+def find(name):
+    for info in registry:
+        if info.name == name:
+            return info
+    return None
+
+
+def load_all():
+    """
+    Import modules of all commands, e.g. to have them ready in the ino
+    server. Return command classes.
+    """
+    return [info.load() for info in registry]
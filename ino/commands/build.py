@@ -1,20 +1,39 @@
 # -*- coding: utf-8; -*-
 
 import re
+import sys
 import os.path
+import time
+import threading
 import inspect
 import subprocess
 import platform
-import jinja2
+import multiprocessing
+import hashlib
+import pickle
+import fcntl
 
-from jinja2.runtime import StrictUndefined
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python < 2.7
+    from ordereddict import OrderedDict
 
 import ino.filters
 
 from ino.commands.base import Command
-from ino.environment import Version
-from ino.filters import colorize
-from ino.utils import SpaceList, list_subdirs
+from ino.commands.preproc import Preprocess
+from ino.environment import Environment, Version
+from ino.dependencies import DependencyGraph, HeaderIndex, IncludeScanner, toposort
+from ino.engine import Engine, Target, mtime_or_none
+from ino.manifest import Manifests
+from ino.explain import Explainer
+from ino.cache import ObjectCache, tool_identity
+from ino.distributed import WorkerPool, compiler_version
+from ino.filters import GlobFile, colorize
+from ino.trace import tracer
+from ino.watch import create_watcher, wait_for_changes
+from ino.utils import SpaceList, FileMap, user_cache_dir
 from ino.exc import Abort
 
 
@@ -39,26 +58,119 @@ class Build(Command):
     name = 'build'
     help_line = "Build firmware from the current directory project"
 
+    # bump whenever sketch preprocessing output changes
+    sketch_cache_version = '2'
+
+    # prepended to output lines when several boards are built at once
+    prefix = None
+
+    # seconds without changes before a rebuild in watch mode
+    watch_delay = 0.3
+
+    # optimization profiles: (compiler flags, extra linker flags, use LTO)
+    profiles = OrderedDict([
+        ('default', (['-Os'], [], False)),
+        ('size', (['-Os', '-flto', '-mcall-prologues'], ['-Wl,--relax'], True)),
+        ('speed', (['-O2'], [], False)),
+        ('fastest', (['-O3'], [], False)),
+    ])
+
+    def __init__(self, environment):
+        super(Build, self).__init__(environment)
+        # board independent state shared by builds for several boards:
+        # preprocessed sketches by digest and parsed includes of files by
+        # -D flags they are parsed with
+        self.preprocessed = {}
+        self.scanners = {}
+        self.index = None
+        self.cache = None
+        self.workers = None
+        self.board_builds = []
+        self.jenv = None
+
     def setup_arg_parser(self, parser):
         super(Build, self).setup_arg_parser(parser)
         self.e.add_board_model_arg(parser)
         self.e.add_arduino_dist_arg(parser)
+        parser.add_argument('--all-models', default=False, action='store_true',
+                            help='Build for all board models found in boards.txt.\n'
+                                 'Several models could also be given to --board-model\n'
+                                 'separated by commas, e.g. -m uno,mega2560')
+        parser.add_argument('--profile', choices=self.profiles.keys(), default='default',
+                            help='Optimization profile (default: %(default)s):\n'
+                                 '  default  -Os\n'
+                                 '  size     -Os with link time optimization,\n'
+                                 '           -mcall-prologues and --relax\n'
+                                 '  speed    -O2\n'
+                                 '  fastest  -O3\n'
+                                 'Objects of every profile are kept in a separate\n'
+                                 'build directory')
+        parser.add_argument('--combine-sketches', default=False, action='store_true',
+                            help='Combine *.ino and *.pde sketches at the top of\n'
+                                 'the source directory into a single C++ source\n'
+                                 'like Arduino Software does with tabs of a sketch')
+        parser.add_argument('--watch', default=False, action='store_true',
+                            help='Keep running and rebuild whenever sources of the\n'
+                                 'project or used libraries change')
+        parser.add_argument('--upload', default=False, action='store_true',
+                            help='Upload the firmware after a successful build')
+        parser.add_argument('-p', '--serial-port', metavar='PORT',
+                            help='Serial port to upload firmware to with --upload\n'
+                                 'Try to guess if not specified')
         parser.add_argument('-v', '--verbose', default=False, action='store_true',
                             help='Verbose make output')
+        parser.add_argument('-j', '--jobs', metavar='N', type=int, default=None,
+                            help='Number of compile jobs to run simultaneously\n'
+                                 '(default: number of CPUs, or the jobserver of\n'
+                                 'a parent make if ino is called from a Makefile)')
+        parser.add_argument('--engine', choices=['make', 'native'], default='make',
+                            help='Build engine to use: generated Makefiles run by GNU make\n'
+                                 'or builtin one that does not need make (default: %(default)s)')
+        parser.add_argument('--cache', default=False, action='store_true',
+                            help='Reuse objects compiled from identical sources with\n'
+                                 'identical flags by any project. Native engine only.\n'
+                                 'See `ino cache --help\'')
+        parser.add_argument('--cache-size', metavar='SIZE', default=ObjectCache.default_max_size,
+                            help='Maximum size of the object cache (default: %(default)s)')
+        parser.add_argument('--pch', default=False, action='store_true',
+                            help='Precompile Arduino.h (WProgram.h) once per build\n'
+                                 'directory and use it for C++ sources')
+        parser.add_argument('--workers', metavar='HOST:PORT,...',
+                            help='Compile on given machines running `ino worker\'.\n'
+                                 'Sources are preprocessed, archived and linked locally.\n'
+                                 'Number of jobs defaults to the number of CPUs times\n'
+                                 'the number of machines, this one included')
+        parser.add_argument('--trace', metavar='FILE',
+                            help='Write timings of build phases and targets to FILE in\n'
+                                 'Chrome trace event format (see chrome://tracing) and\n'
+                                 'print the slowest steps. With the make engine\n'
+                                 'compiles are timed by a launcher, while archives\n'
+                                 'and firmware are timed by the native engine only')
+        parser.add_argument('--explain', default=False, action='store_true',
+                            help='Tell why every target was rebuilt and how much\n'
+                                 'time was spent on every cause of rebuilds. With\n'
+                                 'the make engine times are estimated from mtimes')
+        parser.add_argument('--shared-libs', default=False, action='store_true',
+                            help='Build Arduino core and standard libraries once per\n'
+                                 'machine for each board and set of flags and link\n'
+                                 'ready archives from ~/.cache/ino/archives')
 
     def discover(self):
-        self.e.find_arduino_dir('arduino_core_dir', 
-                                ['hardware', 'arduino', 'cores', 'arduino'], 
-                                ['Arduino.h'] if self.e.arduino_lib_version.major else ['WProgram.h'], 
-                                'Arduino core library')
-
-        self.e.find_arduino_dir('arduino_libraries_dir', ['libraries'],
-                                human_name='Arduino standard libraries')
+        # lookups below are independent, so they are run at once, which
+        # matters on a cold start with slow file systems and long $PATH
+        arduino_h = ['Arduino.h'] if self.e.arduino_lib_version.major else ['WProgram.h']
+        lookups = [
+            lambda: self.e.find_arduino_dir('arduino_core_dir',
+                                            ['hardware', 'arduino', 'cores', 'arduino'],
+                                            arduino_h, 'Arduino core library'),
+            lambda: self.e.find_arduino_dir('arduino_libraries_dir', ['libraries'],
+                                            human_name='Arduino standard libraries'),
+        ]
 
         if self.e.arduino_lib_version.major:
-            self.e.find_arduino_dir('arduino_variants_dir',
-                                    ['hardware', 'arduino', 'variants'],
-                                    human_name='Arduino variants directory')
+            lookups.append(lambda: self.e.find_arduino_dir('arduino_variants_dir',
+                                                           ['hardware', 'arduino', 'variants'],
+                                                           human_name='Arduino variants directory'))
 
         toolset = [
             ('cc', 'avr-gcc'),
@@ -68,19 +180,51 @@ class Build(Command):
         ]
 
         for tool_key, tool_binary in toolset:
-            self.e.find_arduino_tool(
-                tool_key, ['hardware', 'tools', 'avr', 'bin'], 
-                items=[tool_binary], human_name=tool_binary)
+            lookups.append(lambda tool_key=tool_key, tool_binary=tool_binary:
+                           self.e.find_arduino_tool(tool_key, ['hardware', 'tools', 'avr', 'bin'],
+                                                    items=[tool_binary], human_name=tool_binary))
+
+        self.e.find_all(lookups)
+
+    def setup_archiver(self, lto):
+        """
+        Archives of LTO objects need a symbol index created by the linker
+        plugin, i.e. by avr-gcc-ar instead of plain avr-ar. Without it the
+        objects are made fat, that is containing regular code too. Return
+        compiler flags needed for that.
+        """
+        self.e['archiver'] = self.e.ar
+        if not lto:
+            return []
+        try:
+            self.e['archiver'] = self.e.find_arduino_tool(
+                'gcc_ar', ['hardware', 'tools', 'avr', 'bin'],
+                items=['avr-gcc-ar'], human_name='avr-gcc-ar')
+        except Abort:
+            # before gcc 4.7 LTO objects are always fat and the flag is
+            # unknown
+            version = compiler_version(self.e.cc) or ''
+            if [int(n) for n in re.findall(r'\d+', version)[:2]] < [4, 7]:
+                return []
+            print colorize('Using fat LTO objects for libraries', 'yellow')
+            return ['-ffat-lto-objects']
+        return []
+
+    def setup_flags(self, board_key, profile='default'):
+        if profile not in self.profiles:
+            raise Abort('%s is not a valid profile, available are: %s' %
+                        (profile, ', '.join(self.profiles)))
+        opt_flags, link_flags, lto = self.profiles[profile]
 
-    def setup_flags(self, board_key):
         board = self.e.board_model(board_key)
         mcu = '-mmcu=' + board['build']['mcu']
+        lto_flags = self.setup_archiver(lto)
         self.e['cflags'] = SpaceList([
             mcu,
             '-ffunction-sections',
             '-fdata-sections',
             '-g',
-            '-Os', 
+        ] + opt_flags + lto_flags + [
             '-w',
             '-DF_CPU=' + board['build']['f_cpu'],
             '-DARDUINO=' + str(self.e.arduino_lib_version.as_int()),
@@ -98,7 +242,9 @@ class Build(Command):
             self.e.cflags.append('-I' + variant_dir)
 
         self.e['cxxflags'] = SpaceList(['-fno-exceptions'])
-        self.e['elfflags'] = SpaceList(['-Os', '-Wl,--gc-sections', mcu])
+        # with LTO code is generated at link time, so optimization flags
+        # should be passed to the linker too
+        self.e['elfflags'] = SpaceList(opt_flags + ['-Wl,--gc-sections'] + link_flags + [mcu])
 
         self.e['names'] = {
             'obj': '%s.o',
@@ -107,10 +253,26 @@ class Build(Command):
             'deps': '%s.d',
         }
 
+    templates_dir = os.path.join(os.path.dirname(__file__), '..', 'make')
+
     def create_jinja(self, verbose):
-        templates_dir = os.path.join(os.path.dirname(__file__), '..', 'make')
+        if self.jenv:
+            # kept between rebuilds in watch mode
+            return
+
+        # jinja2 is needed by the make engine only and takes a while to
+        # import, so it is not imported with the module
+        import jinja2
+        from jinja2.runtime import StrictUndefined
+
+        # compiled templates are cached across runs and projects
+        bytecode_dir = user_cache_dir('jinja')
+        if not os.path.isdir(bytecode_dir):
+            os.makedirs(bytecode_dir)
+
         self.jenv = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(templates_dir),
+            loader=jinja2.FileSystemLoader(self.templates_dir),
+            bytecode_cache=jinja2.FileSystemBytecodeCache(bytecode_dir),
             undefined=StrictUndefined, # bark on Undefined render
             extensions=['jinja2.ext.do'])
 
@@ -124,87 +286,755 @@ class Build(Command):
         self.jenv.globals['slash'] = os.path.sep
         self.jenv.globals['SpaceList'] = SpaceList
 
+    def fingerprint(self, source, ctx):
+        """
+        Digest of everything a rendered template depends on: templates,
+        environment, render context and listings of scanned directories.
+        Directory listings are represented by mtimes of directories since
+        adding, removing or renaming a file changes mtime of its directory.
+        Objects are written next to sources made from sketches, so those
+        are represented by their names instead.
+        """
+        h = hashlib.md5()
+        env = sorted((k, v) for k, v in self.e.iteritems() if k != 'board_models')
+        made = sorted(str(s) for s in ino.filters.glob(self.src_build_dir, '*.cpp'))
+        h.update(pickle.dumps((source, sorted(ctx.items()), env,
+                               self.jenv.globals['v'], made), pickle.HIGHEST_PROTOCOL))
+
+        dirs = [self.templates_dir, self.e.src_dir]
+        dirs.extend(self.e.get('lib_archives', {}).keys())
+        for top in dirs:
+            for dirpath, dirnames, filenames in os.walk(top):
+                h.update('%s\0%r\0' % (dirpath, os.path.getmtime(dirpath)))
+                if top == self.templates_dir:
+                    for name in filenames:
+                        path = os.path.join(dirpath, name)
+                        h.update('%s\0%r\0' % (path, os.path.getmtime(path)))
+        return h.hexdigest()
+
     def render_template(self, source, target, **ctx):
+        """
+        Render a template into the build directory. If a file rendered
+        from exactly the same inputs exists already it is left untouched.
+        """
+        out_path = os.path.join(self.e.build_dir, target)
+        header = '# ino fingerprint: %s\n' % self.fingerprint(source, ctx)
+        if os.path.exists(out_path):
+            with open(out_path) as f:
+                if f.readline() == header:
+                    return out_path
+
         template = self.jenv.get_template(source)
         contents = template.render(**ctx)
-        out_path = os.path.join(self.e.build_dir, target)
         with open(out_path, 'wt') as f:
+            f.write(header)
             f.write(contents)
 
         return out_path
 
+    def make_supports_output_sync(self):
+        # --output-sync is available since GNU make 4.0
+        if 'make_output_sync' not in self.e:
+            places = [os.environ.get('PATH', '')]
+            if self.e.cached('make_output_sync', places) is None:
+                try:
+                    out = subprocess.Popen(['make', '--version'],
+                                           stdout=subprocess.PIPE).communicate()[0]
+                except OSError:
+                    out = ''
+                match = re.match(r'GNU Make (\d+)', out)
+                self.e.remember('make_output_sync', bool(match) and int(match.group(1)) >= 4,
+                                places)
+        return self.e['make_output_sync']
+
+    def setup_make(self, jobs, instances=1):
+        self.make_flags = []
+
+        # When ino is run from a recipe of a parent `make -jN` the sub-make
+        # inherits its jobserver through MAKEFLAGS. Forcing own -j would
+        # disable the jobserver and oversubscribe CPUs, so do it only if
+        # asked explicitly.
+        jobserver = re.search(r'--jobserver-(fds|auth)=', os.environ.get('MAKEFLAGS', ''))
+        if jobs is None and not jobserver:
+            jobs = multiprocessing.cpu_count()
+        if jobs is not None:
+            # jobs are split between make instances running simultaneously
+            jobs = max(1, jobs // instances)
+            self.make_flags.append('-j%d' % jobs)
+        self.jobs = jobs or multiprocessing.cpu_count()
+
+        # do not let output of parallel compiler runs interleave
+        if jobs != 1 and self.make_supports_output_sync():
+            self.make_flags.append('--output-sync=target')
+
     def make(self, makefile, **kwargs):
-        makefile = self.render_template(makefile + '.jinja', makefile, **kwargs)
-        ret = subprocess.call(['make', '-f', makefile, 'all'])
+        with tracer.phase('render ' + makefile):
+            makefile = self.render_template(makefile + '.jinja', makefile, **kwargs)
+        command = ['make', '-f', makefile] + self.make_flags + ['all']
+        with tracer.phase('make ' + makefile):
+            if self.prefix:
+                ret = self.call_prefixed(command)
+            else:
+                ret = subprocess.call(command)
         if ret != 0:
             raise Abort("Make failed with code %s" % ret)
 
-    def recursive_inc_lib_flags(self, libdirs):
-        flags = SpaceList()
+    def call_prefixed(self, command):
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        for line in iter(proc.stdout.readline, ''):
+            with Engine.output_lock:
+                print self.prefix + line.rstrip('\n')
+        return proc.wait()
+
+    @property
+    def index_filepath(self):
+        return user_cache_dir('headers.pickle')
+
+    def load_index(self):
+        if self.index is None:
+            self.index = HeaderIndex()
+            self.index.load(self.index_filepath)
+        return self.index
+
+    def recursive_inc_lib_dirs(self, libdirs):
+        dirs = []
         for d in libdirs:
-            flags.append('-I' + d)
-            flags.extend('-I' + subd for subd in list_subdirs(d, recursive=True, exclude=['examples']))
-        return flags
-
-    def _scan_dependencies(self, dir, lib_dirs, inc_flags):
-        output_filepath = os.path.join(self.e.build_dir, os.path.basename(dir), 'dependencies.d')
-        self.make('Makefile.deps', inc_flags=inc_flags, src_dir=dir, output_filepath=output_filepath)
-        self.e['deps'].append(output_filepath)
-
-        # search for dependencies on libraries
-        # for this scan dependency file generated by make
-        # with regexes to find entries that start with
-        # libraries dirname
-        regexes = dict((lib, re.compile(r'\s' + lib + re.escape(os.path.sep))) for lib in lib_dirs)
-        used_libs = set()
-        with open(output_filepath) as f:
-            for line in f:
-                for lib, regex in regexes.iteritems():
-                    if regex.search(line) and lib != dir:
-                        used_libs.add(lib)
-
-        return used_libs
-
-    def scan_dependencies(self):
-        self.e['deps'] = SpaceList()
-
-        lib_dirs = [self.e.arduino_core_dir] + list_subdirs(self.e.lib_dir) + list_subdirs(self.e.arduino_libraries_dir)
-        inc_flags = self.recursive_inc_lib_flags(lib_dirs)
+            dirs.append(d)
+            dirs.extend(self.index.subdirs(d, recursive=True, exclude=['examples']))
+        return dirs
+
+    def inc_lib_flags(self, libdirs, sources, cflags):
+        """
+        Return -I flags for directories of `libdirs' and their
+        subdirectories which are needed to compile `sources', i.e. the
+        ones where headers included by the sources were found, and which
+        are not in `cflags' already.
+        """
+        used = self.graph.include_dirs(sources)
+        return SpaceList('-I' + d for d in self.recursive_inc_lib_dirs(libdirs)
+                         if d in used and '-I' + d not in cflags)
+
+    @property
+    def src_build_dir(self):
+        return os.path.join(self.e.build_dir, os.path.basename(self.e.src_dir))
+
+    def sources(self, dir):
+        """
+        Return sources to be compiled for the project or library `dir'.
+        Processed sketches are taken into account for the project.
+        """
+        sources = ino.filters.glob(dir, '*.c', '*.cpp')
+        if dir == self.e.src_dir:
+            sources += ino.filters.glob(self.src_build_dir, '*.cpp')
+        return sources
+
+    def quote_dirs(self, path):
+        # processed sketches are compiled with `-iquote' pointing to
+        # their origin, see Makefile.common.jinja
+        if path.startswith(self.src_build_dir):
+            return [os.path.dirname(os.path.join(
+                self.e.src_dir, os.path.relpath(path, self.src_build_dir)))]
+        return []
+
+    def write_dependency_file(self, filepath, target, source, headers):
+        """
+        Write make rules adding headers as prerequisites of the target.
+        Headers get empty rules so that make doesn't fail if one is deleted.
+        """
+        lines = ['%s : %s' % (target, ' \\\n  '.join([source] + headers))]
+        lines.extend('%s :' % h for h in headers)
+        contents = '\n'.join(lines) + '\n'
+
+        if os.path.exists(filepath):
+            with open(filepath) as f:
+                if f.read() == contents:
+                    return
+
+        dirname = os.path.dirname(filepath)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_filepath = '%s.%d' % (filepath, os.getpid())
+        with open(tmp_filepath, 'wt') as f:
+            f.write(contents)
+        os.rename(tmp_filepath, filepath)
+
+    def scan_dependencies(self, shared_libs=False, pch=False):
+        index = self.load_index()
+        lib_dirs = ([self.e.arduino_core_dir] + index.subdirs(self.e.lib_dir) +
+                    index.subdirs(self.e.arduino_libraries_dir))
+        inc_dirs = [f[2:] for f in self.e.cflags if f.startswith('-I')]
+        inc_dirs += self.recursive_inc_lib_dirs(lib_dirs)
+
+        # conditional includes are told by macros of the build
+        defines = dict((f[2:].split('=', 1) + ['1'])[:2] for f in self.e.cflags
+                       if f.startswith('-D'))
+        key = tuple(sorted(defines.items()))
+        scanner = self.scanners.setdefault(key, IncludeScanner(defines=defines))
+
+        graph = DependencyGraph(lib_dirs, inc_dirs, self.quote_dirs, self.jobs,
+                                scanner, index)
+        graph_filepath = os.path.join(self.e.build_dir, 'dependencies.pickle')
+        graph.load(graph_filepath)
 
         # If lib A depends on lib B it have to appear before B in final
         # list so that linker could link all together correctly
-        # but order of `_scan_dependencies` is not defined, so...
-        
-        # 1. Get dependencies of sources in arbitrary order
-        used_libs = list(self._scan_dependencies(self.e.src_dir, lib_dirs, inc_flags))
-
-        # 2. Get dependencies of dependency libs themselves: existing dependencies
-        # are moved to the end of list maintaining order, new dependencies are appended
-        scanned_libs = set()
-        while scanned_libs != set(used_libs):
-            for lib in set(used_libs) - scanned_libs:
-                dep_libs = self._scan_dependencies(lib, lib_dirs, inc_flags)
-
-                i = 0
-                for ulib in used_libs[:]:
-                    if ulib in dep_libs:
-                        # dependency lib used already, move it to the tail
-                        used_libs.append(used_libs.pop(i))
-                        dep_libs.remove(ulib)
-                    else:
-                        i += 1
-
-                # append new dependencies to the tail
-                used_libs.extend(dep_libs)
-                scanned_libs.add(lib)
+        sources_of = lambda dir: [s.path for s in self.sources(dir)]
+        used_libs = graph.scan(self.e.src_dir, sources_of)
+        graph.dump(graph_filepath)
+        index.dump(self.index_filepath)
 
+        self.graph = graph
         self.e['used_libs'] = used_libs
-        self.e['cflags'].extend(self.recursive_inc_lib_flags(used_libs))
+        self.e['optional_libs'] = graph.optional_libs
+        self.setup_lib_archives(shared_libs)
+        self.setup_pch(pch)
+
+        # dependency files for make, so that changes in a header file
+        # would rebuild all sources including it
+        build_subdirs = [(self.e.src_dir, self.src_build_dir)]
+        build_subdirs += [(lib, target.dirname) for lib, target in self.e.lib_archives.iteritems()]
+        for dir, build_subdir in build_subdirs:
+            for source in self.sources(dir):
+                target = os.path.join(build_subdir, str(source))
+                self.write_dependency_file(ino.filters.depsname(target),
+                                           ino.filters.objname(target),
+                                           source.path, graph.headers(source.path))
+
+        if self.e.pch:
+            self.write_dependency_file(ino.filters.depsname(self.e.pch.path), self.e.pch.path,
+                                       self.e.pch_header, graph.headers(self.e.pch_header))
+
+    def is_shared_lib(self, lib):
+        """
+        Tell whether a library could be built once for all projects: it
+        should be the core or a standard library and use only such ones.
+        """
+        std_prefix = os.path.join(self.e.arduino_libraries_dir, '')
+        is_std = lambda d: d == self.e.arduino_core_dir or d.startswith(std_prefix)
+        deps = toposort(self.graph.libs, self.graph.libs.get(lib, []))
+        return is_std(lib) and all(is_std(d) for d in deps)
+
+    def shared_lib_dir(self, lib, cflags):
+        h = hashlib.md5()
+        for item in [tool_identity(self.e.cc), tool_identity(self.e.cxx),
+                     tool_identity(self.e.archiver), os.path.realpath(lib)] + cflags + self.e.cxxflags:
+            h.update(item + '\0')
+        dirname = '%s-%s' % (os.path.basename(lib), h.hexdigest()[:16])
+        return user_cache_dir('archives', dirname)
+
+    def setup_lib_archives(self, shared_libs=False):
+        """
+        Decide where each used library is built and with what flags.
+
+        By default libraries are built into the project build directory with
+        include paths of all used libraries. Shared ones are compiled only
+        with include paths of libraries they depend on and go to a machine
+        wide store keyed by the toolchain, the library and the flags, so that
+        any project for the same board reuses ready archives.
+        """
+        base_cflags = SpaceList(self.e.cflags)
+        sources = [s.path for d in [self.e.src_dir] + self.e.used_libs for s in self.sources(d)]
+        # headers of optionally included libraries are found if a condition
+        # the dependency scan doesn't know turns out to be true
+        self.e['cflags'].extend(self.inc_lib_flags(self.e.used_libs + self.e.optional_libs,
+                                                   sources, base_cflags))
+
+        self.e['lib_archives'] = FileMap()
+        self.e['lib_cflags'] = {}
+        self.e['shared_libs'] = []
+        for lib in self.e.used_libs:
+            if shared_libs and self.is_shared_lib(lib):
+                deps = toposort(self.graph.libs, self.graph.libs.get(lib, []))
+                sources = [s.path for s in self.sources(lib)]
+                cflags = base_cflags + self.inc_lib_flags([lib] + deps, sources, base_cflags)
+                build_subdir = self.shared_lib_dir(lib, cflags)
+                self.e['shared_libs'].append(lib)
+            else:
+                cflags = self.e.cflags
+                build_subdir = os.path.join(self.e.build_dir, os.path.basename(lib))
+            archive = ino.filters.libname(os.path.basename(lib))
+            self.e['lib_archives'][lib] = GlobFile(archive, build_subdir)
+            self.e['lib_cflags'][lib] = cflags
+
+    def setup_pch(self, enabled):
+        """
+        Setup precompiled core header. It is built with the project flags so
+        it is used for the project sources and libraries built in the project
+        build directory, but not for shared ones.
+
+        GCC looks for <header>.gch in every include directory before the
+        header itself, so the directory with the precompiled header goes
+        first on the command line. The header is used if it is included
+        before any C++ token, which is always the case for sketches.
+        Subsequent includes find a stub next to it that passes on to the
+        real header.
+        """
+        if not enabled:
+            self.e['pch'] = None
+            return
+
+        header = 'Arduino.h' if self.e.arduino_lib_version.major else 'WProgram.h'
+        pch_dir = os.path.join(self.e.build_dir, 'pch')
+        self.e['pch'] = GlobFile(header + '.gch', pch_dir)
+        self.e['pch_header'] = os.path.normpath(os.path.join(self.e.arduino_core_dir, header))
+        self.e['pch_flags'] = SpaceList(['-I' + pch_dir])
+        self.graph.resolve([self.e.pch_header])
+
+        stub_path = os.path.join(pch_dir, header)
+        if not os.path.exists(stub_path):
+            if not os.path.isdir(pch_dir):
+                os.makedirs(pch_dir)
+            with open(stub_path, 'wt') as f:
+                f.write('#include_next <%s>\n' % header)
+
+    def lock_shared_libs(self):
+        """
+        Lock shared library directories used by the build so that a
+        concurrent build of another project doesn't write the same files.
+        """
+        self.locks = []
+        dirs = sorted(self.e.lib_archives[lib].dirname for lib in self.e.shared_libs)
+        for d in dirs:
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            lock = open(os.path.join(d, '.lock'), 'w')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                print colorize('Waiting for %s locked by another build ...' % d, 'yellow')
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            self.locks.append(lock)
+
+    def unlock_shared_libs(self):
+        for lock in self.locks:
+            lock.close()
+        self.locks = []
+
+    def sketch_units(self, combine=False):
+        """
+        Return (target, sources) pairs telling which sketches go to which
+        C++ source in the build directory. Every sketch goes to a source of
+        its own, unless `combine' is set: then sketches at the top of the
+        source directory are joined into one source like tabs of a sketch
+        in Arduino Software. The main sketch, the one named after the
+        project directory, comes first and gives its name to the source.
+        """
+        sketches = sorted(ino.filters.glob(self.e.src_dir, '*.pde', '*.ino'), key=str)
+        units = []
+        if combine:
+            tabs = [s for s in sketches if os.sep not in s.filename]
+            if tabs:
+                project = os.path.basename(os.getcwd())
+                tabs.sort(key=lambda s: os.path.splitext(s.filename)[0] != project)
+                units.append((tabs[0], tabs))
+                sketches = [s for s in sketches if s not in tabs]
+        units += [(s, [s]) for s in sketches]
+        return [(ino.filters.xname(os.path.join(self.src_build_dir, str(main)),
+                                   self.e.names['cpp']), sources)
+                for main, sources in units]
+
+    def preprocess_sketches(self, combine=False):
+        """
+        Transform *.ino and *.pde sketches into C++ sources in the build
+        directory, all in the current process.
+
+        A source is made again only if mtime or size of any of its sketches
+        changed and its content digest differs from the one of the existing
+        output. The output is not rewritten if it stays the same, so
+        a touched or checked out again sketch doesn't lead to recompilation.
+        Sources left from removed sketches or from the other `combine' mode
+        are removed.
+        """
+        cache_filepath = os.path.join(self.e.build_dir, 'sketches.pickle')
+        cache = {}
+        if os.path.exists(cache_filepath):
+            try:
+                with open(cache_filepath, 'rb') as f:
+                    cache = pickle.load(f)
+            except Exception:
+                pass
+
+        preproc = Preprocess(self.e)
+        units = self.sketch_units(combine)
+        new_cache = {}
+        for target, sources in units:
+            stats = []
+            for source in sources:
+                st = os.stat(source.path)
+                stats.append((source.path, st.st_mtime, st.st_size))
+            entry = cache.get(target)
+            if entry and entry[0] == stats and os.path.exists(target):
+                new_cache[target] = entry
+                continue
+
+            sketches = []
+            for source in sources:
+                with open(source.path, 'rt') as f:
+                    sketches.append((source.path, f.read()))
+            h = hashlib.md5()
+            h.update('\0'.join([self.sketch_cache_version, preproc.header] +
+                               [part for sketch in sketches for part in sketch]))
+            digest = h.hexdigest()
+            new_cache[target] = (stats, digest)
+            if entry and entry[1] == digest and os.path.exists(target):
+                continue
+
+            for source in sources:
+                print colorize(source.path, 'yellow')
+            if digest not in self.preprocessed:
+                self.preprocessed[digest] = preproc.combine(sketches)
+            contents = self.preprocessed[digest]
+            if os.path.exists(target):
+                with open(target, 'rt') as f:
+                    if f.read() == contents:
+                        continue
+            elif not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            with open(target, 'wt') as f:
+                f.write(contents)
+
+        # the build directory of sources holds nothing but made sources
+        # and their objects, so any other source would be compiled in
+        targets = set(target for target, sources in units)
+        for source in ino.filters.glob(self.src_build_dir, '*.cpp'):
+            if source.path not in targets:
+                os.remove(source.path)
+
+        if new_cache != cache:
+            with open(cache_filepath, 'wb') as f:
+                pickle.dump(new_cache, f, pickle.HIGHEST_PROTOCOL)
+
+    def compile_target(self, source, target_dir, cflags, pch=None):
+        obj = ino.filters.xname(os.path.join(target_dir, str(source)), self.e.names['obj'])
+        inputs = [source.path] + self.graph.headers(source.path)
+        if source.filename.endswith('.c'):
+            command = [self.e.cc] + cflags
+        elif pch:
+            command = [self.e.cxx] + self.e.pch_flags + cflags + self.e.cxxflags
+            inputs.append(pch)
+        else:
+            command = [self.e.cxx] + cflags + self.e.cxxflags
+        for d in self.quote_dirs(source.path):
+            command += ['-iquote', d]
+        command += ['-o', obj, '-c', source.path]
+
+        message = os.path.join(os.path.basename(source.dirname), source.filename)
+        runner = None
+        if self.cache:
+            runner = self.cache.compile
+        elif self.workers:
+            runner = self.workers.compile
+        return Target(obj, inputs, command, runner=runner, message=message)
+
+    def firmware_target(self):
+        """
+        Targets of the native engine mirroring Makefile.jinja
+        """
+        pch = None
+        if self.e.pch:
+            header = self.e.pch_header
+            pch = Target(self.e.pch.path, [header] + self.graph.headers(header),
+                         [self.e.cxx] + self.e.cflags + self.e.cxxflags +
+                         ['-x', 'c++-header', '-o', self.e.pch.path, header],
+                         message='Precompiling ' + os.path.basename(header))
+
+        libs = []
+        for lib, archive in self.e.lib_archives.iteritems():
+            sources = ino.filters.glob(lib, '*.c') + ino.filters.glob(lib, '*.cpp')
+            lib_pch = pch if lib not in self.e.shared_libs else None
+            objs = [self.compile_target(s, archive.dirname, self.e.lib_cflags[lib], lib_pch)
+                    for s in sources]
+            libs.append(Target(archive.path, objs,
+                               [self.e.archiver, 'rcs', archive.path] + [o.path for o in objs],
+                               message='Linking ' + archive.filename, color='green'))
+
+        sources = (ino.filters.glob(self.e.src_dir, '*.c') +
+                   ino.filters.glob(self.e.src_dir, '*.cpp') +
+                   ino.filters.glob(self.src_build_dir, '*.cpp'))
+        objs = [self.compile_target(s, self.src_build_dir, self.e.cflags, pch) for s in sources]
+        objs += libs
+
+        elf_path = os.path.join(self.e.build_dir, 'firmware.elf')
+        elf = Target(elf_path, objs,
+                     [self.e.cc] + self.e.elfflags + ['-o', elf_path] + [o.path for o in objs] + ['-lm'],
+                     message='Linking firmware.elf', color='green')
+
+        return Target(self.e.hex_path, [elf],
+                      [self.e.objcopy, '-O', 'ihex', '-R', '.eeprom', elf_path, self.e.hex_path],
+                      message='Converting to ' + self.e.hex_filename, color='green')
+
+    def prepare(self, args, board_key, instances=1):
+        """
+        Do everything before actual compilation: setup flags, preprocess
+        sketches and find used libraries.
+        """
+        with tracer.phase('setup flags'):
+            self.setup_flags(board_key, args.profile)
+        with tracer.phase('preprocess sketches'):
+            self.preprocess_sketches(args.combine_sketches)
+        jobs = args.jobs
+        if jobs is None and self.workers:
+            jobs = multiprocessing.cpu_count() * (len(self.workers.addresses) + 1)
+        if args.engine == 'native':
+            self.jobs = jobs or multiprocessing.cpu_count()
+        else:
+            self.create_jinja(verbose=args.verbose)
+            self.setup_make(jobs, instances)
+            self.e['compile_launcher'] = ''
+            if self.workers:
+                self.e['compile_launcher'] = '%s -m ino.distributed %s -- ' % (sys.executable,
+                                                                               args.workers)
+            if args.trace:
+                # make doesn't report timings, compiles are timed by a launcher
+                self.e['compile_launcher'] = '%s -m ino.trace %s -- %s' % (
+                    sys.executable, self.trace_records_filepath, self.e['compile_launcher'])
+        with tracer.phase('scan dependencies'):
+            self.scan_dependencies(args.shared_libs, args.pch)
+
+    @property
+    def trace_records_filepath(self):
+        return os.path.join(self.e.build_dir, 'trace-records.jsonl')
+
+    def restamp(self, targets, manifests):
+        """
+        Make mtimes of targets tell make what manifests do: a target which
+        is up to date by contents of its inputs and its command gets newer
+        than its inputs, an outdated one gets older, whatever the mtimes
+        were before.
+        """
+        for target in targets:
+            if not manifests.covers(target) or not manifests.has(target):
+                continue
+            if not os.path.exists(target.path):
+                continue
+            current_mtime = os.path.getmtime(target.path)
+            if manifests.is_current(target):
+                mtimes = [os.path.getmtime(p) for p in target.input_paths() if os.path.exists(p)]
+                if not mtimes or current_mtime > max(mtimes):
+                    # already newer, the mtime is left as is so that digests
+                    # of manifests stay valid
+                    continue
+                # utime() may truncate to microseconds, which must not make
+                # the target older than inputs with nanosecond mtimes
+                mtime = max(mtimes) + 0.001
+            elif current_mtime == 0:
+                continue
+            else:
+                mtime = 0
+            os.utime(target.path, (mtime, mtime))
+
+    def explain_make(self, targets, reasons, mtimes, start, explainer):
+        """
+        Tell explainer about targets rebuilt by make, i.e. the ones whose
+        mtimes differ from `mtimes' taken before make ran. Targets which
+        were up to date before were rebuilt because of their inputs. Make
+        doesn't report timings, so time of a target is estimated as the
+        time between its mtime and the latest mtime of rebuilt inputs.
+        """
+        rebuilt = set()
+        for target in targets:
+            mtime = mtime_or_none(target.path)
+            if mtime is None or mtime == mtimes[target.path]:
+                continue
+            inputs = [t for t in target.input_targets() if t.path in rebuilt]
+            reason = reasons[target]
+            if reason is None:
+                reason = ('rebuilt', inputs[0].path) if inputs else ('unknown', None)
+            begin = max([start] + [os.path.getmtime(t.path) for t in inputs])
+            explainer.add(target, reason, max(0, mtime - begin))
+            rebuilt.add(target.path)
+
+    def make_with_manifests(self, manifests, explainer=None):
+        targets = Engine().collect([self.firmware_target()])
+        if explainer:
+            engine = Engine(manifests=manifests)
+            reasons = dict((t, engine.stale_reason(t)) for t in targets)
+        with tracer.phase('restamp targets'):
+            self.restamp(targets, manifests)
+
+        if os.path.exists(self.trace_records_filepath):
+            os.remove(self.trace_records_filepath)
+        # targets built by make are told by changed mtimes
+        mtimes = dict((t.path, mtime_or_none(t.path)) for t in targets)
+        start = time.time()
+        succeeded = False
+        try:
+            self.make('Makefile')
+            succeeded = True
+        finally:
+            tracer.load_records(self.trace_records_filepath)
+            if explainer:
+                self.explain_make(targets, reasons, mtimes, start, explainer)
+            # after a failure only targets built by this run are known to
+            # match their inputs
+            for target in targets:
+                if not manifests.covers(target) or not os.path.exists(target.path):
+                    continue
+                if succeeded or mtime_or_none(target.path) != mtimes[target.path]:
+                    manifests.record(target)
+
+    def build(self, args, slots=None):
+        manifests = Manifests(self.e.build_dir)
+        manifests.load()
+        explainer = Explainer() if args.explain else None
+        self.lock_shared_libs()
+        try:
+            if args.engine == 'native':
+                engine = Engine(self.jobs, verbose=args.verbose, slots=slots, prefix=self.prefix,
+                                manifests=manifests, explainer=explainer)
+                with tracer.phase('build targets'):
+                    engine.build([self.firmware_target()])
+            else:
+                self.make_with_manifests(manifests, explainer)
+        finally:
+            self.unlock_shared_libs()
+            manifests.dump()
+            if explainer:
+                with Engine.output_lock:
+                    for line in explainer.lines(self.prefix or ''):
+                        print line
+
+    def build_boards(self, args):
+        """
+        Build the project for several board models at once. Sketches are
+        preprocessed and sources are parsed for includes only once for all
+        boards. Then boards are built simultaneously each in its own build
+        directory sharing the total number of jobs.
+        """
+        models = self.e.build_dirs.keys()
+        width = max(len(m) for m in models)
+        jobs = args.jobs or multiprocessing.cpu_count()
+
+        if not self.board_builds:
+            for model in models:
+                e = Environment(self.e)
+                e['build_dir'] = self.e.build_dirs[model]
+                if not os.path.isdir(e.build_dir):
+                    os.makedirs(e.build_dir)
+                build = Build(e)
+                build.prefix = '%-*s | ' % (width, model)
+                build.preprocessed = self.preprocessed
+                build.scanners = self.scanners
+                build.index = self.load_index()
+                build.cache = self.cache
+                build.workers = self.workers
+                self.board_builds.append((model, build))
+
+        builds = self.board_builds
+        for model, build in builds:
+            print colorize('Preparing build for %s' % model, 'cyan')
+            build.prepare(args, model, instances=len(models))
+
+        results = {}
+        slots = threading.Semaphore(jobs)
+
+        def run(model, build):
+            start = time.time()
+            try:
+                with tracer.phase('build ' + model):
+                    build.build(args, slots)
+                error = None
+            except Abort as exc:
+                error = str(exc)
+            except Exception as exc:
+                error = 'Unexpected error: %r' % exc
+            results[model] = (error, time.time() - start)
+
+        threads = [threading.Thread(target=run, args=b) for b in builds]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            # join() with a timeout to stay interruptible by Ctrl+C
+            while t.is_alive():
+                t.join(1)
+
+        print
+        failed = []
+        for model, build in builds:
+            error, elapsed = results[model]
+            if error:
+                failed.append(model)
+                status = colorize('FAILED', 'red')
+                details = error
+            else:
+                status = colorize('ok    ', 'green')
+                details = build.e.hex_path
+            print '%-*s  %s  %7.2fs  %s' % (width, model, status, elapsed, details)
+
+        if failed:
+            raise Abort("Build failed for %s" % ', '.join(failed))
+
+    def build_project(self, args):
+        try:
+            if len(self.e.build_dirs) > 1:
+                self.build_boards(args)
+            else:
+                self.prepare(args, self.e.build_dirs.keys()[0])
+                self.build(args)
+            self.e.remember_profiles()
+        finally:
+            if self.cache:
+                self.cache.flush()
+
+    def watched_dirs(self):
+        builds = [build for model, build in self.board_builds] or [self]
+        dirs = [self.e.src_dir, self.e.lib_dir]
+        for build in builds:
+            dirs.extend(d for d in build.e.get('used_libs', []) if d not in dirs)
+        return [d for d in dirs if os.path.isdir(d)]
+
+    def upload(self, args):
+        # pyserial is imported only if it is needed
+        from ino.commands.upload import Upload
+        Upload(self.e).run(args)
+
+    def watch(self, args):
+        """
+        Build the project and rebuild it whenever sources of the project or
+        of used libraries change. Discovered tools, board models, templates
+        and parsed includes are kept in memory between builds, and only
+        affected objects are compiled again.
+        """
+        watcher = create_watcher()
+        try:
+            while True:
+                # keep events of the current build only, so that they don't
+                # pile up, and --trace records the last build
+                tracer.reset()
+                try:
+                    self.build_project(args)
+                    if args.upload:
+                        self.upload(args)
+                except Abort as exc:
+                    print colorize(str(exc), 'red')
+
+                watcher.add(self.watched_dirs())
+                print colorize('Watching for changes (%s), press Ctrl+C to stop' %
+                               watcher.name, 'cyan')
+                changed = sorted(wait_for_changes(watcher, self.watch_delay))
+                if len(changed) > 3:
+                    changed = changed[:3] + ['and %d more' % (len(changed) - 3)]
+                print colorize('Changed ' + ', '.join(changed), 'cyan')
+        finally:
+            watcher.close()
 
     def run(self, args):
-        self.discover()
-        self.setup_flags(args.board_model)
-        self.create_jinja(verbose=args.verbose)
-        self.make('Makefile.sketch')
-        self.scan_dependencies()
-        self.make('Makefile')
+        with tracer.phase('discover'):
+            self.discover()
+        if args.cache and args.engine != 'native':
+            raise Abort("Object cache is supported by the native build engine only, "
+                        "use --engine=native")
+        if args.upload and len(self.e.build_dirs) > 1:
+            raise Abort("Upload is possible only when building for a single board model")
+
+        self.cache = ObjectCache(max_size=args.cache_size) if args.cache else None
+        self.workers = WorkerPool(args.workers.split(',')) if args.workers else None
+        if self.cache and self.workers:
+            self.cache.run = self.workers.run_command
+        if args.watch:
+            self.watch(args)
+        else:
+            self.build_project(args)
+            if args.upload:
+                self.upload(args)
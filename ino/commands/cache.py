@@ -0,0 +1,53 @@
+# -*- coding: utf-8; -*-
+
+from ino.commands.base import Command
+from ino.cache import ObjectCache, format_size, parse_size
+from ino.filters import colorize
+
+
+class Cache(Command):
+    """
+    Inspect or clear the object cache.
+
+    The cache is shared by all projects and is used by
+    `ino build --engine=native --cache'. Compiled objects are stored there
+    by a digest of preprocessed source, compiler flags and the compiler
+    binary, so that identical Arduino core and libraries sources are not
+    recompiled for every project and board build directory.
+
+    Available actions:
+
+        * stats -- print hit/miss statistics and the cache size
+        * clear -- remove all cached objects and statistics
+    """
+
+    name = 'cache'
+    help_line = "Inspect or clear the object cache"
+
+    def setup_arg_parser(self, parser):
+        super(Cache, self).setup_arg_parser(parser)
+        parser.add_argument('action', choices=['stats', 'clear'], help='Action to perform')
+        parser.add_argument('--cache-size', metavar='SIZE', default=ObjectCache.default_max_size,
+                            help='Maximum size of the object cache (default: %(default)s)')
+
+    def run(self, args):
+        cache = ObjectCache(max_size=args.cache_size)
+        if args.action == 'clear':
+            cache.clear()
+            return
+
+        stats = cache.stats()
+        total = stats['hits'] + stats['misses']
+        rate = 100. * stats['hits'] / total if total else 0
+        entries = list(cache.entries())
+        rows = [
+            ('cache directory', cache.cache_dir),
+            ('hits', '%d' % stats['hits']),
+            ('misses', '%d' % stats['misses']),
+            ('hit rate', '%.1f%%' % rate),
+            ('files', '%d' % len(entries)),
+            ('cache size', '%s of %s' % (format_size(sum(st.st_size for _, st in entries)),
+                                         format_size(parse_size(args.cache_size)))),
+        ]
+        for key, val in rows:
+            print '%s %s' % (colorize('%16s:' % key, 'cyan'), val)
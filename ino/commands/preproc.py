@@ -1,7 +1,9 @@
 # -*- coding: utf-8; -*-
 
 import sys
-import re
+import os.path
+
+import ino.sketch
 
 from ino.commands.base import Command
 from ino.exc import Abort
@@ -9,78 +11,89 @@ from ino.exc import Abort
 
 class Preprocess(Command):
     """
-    Preprocess an .ino or .pde sketch file and produce ready-to-compile .cpp source.
+    Preprocess .ino or .pde sketch files and produce ready-to-compile .cpp sources.
 
     Ino mimics steps that are performed by official Arduino Software to
     produce similar result:
 
         * Either #include <Arduino.h> or <WProgram.h> is prepended
         * Function prototypes are added at the beginning of file
+
+    If several sketches are given the output should be a directory, each
+    sketch goes to a .cpp file of the same name there. With --combine
+    sketches are joined into a single source instead, the way Arduino
+    Software joins tabs of a sketch: the first sketch is the main one and
+    gives its name to the source, prototypes of all sketches come before
+    any of them and #line directives point to the original files.
     """
 
     name = 'preproc'
-    help_line = "Transform a sketch file into valid C++ source"
+    help_line = "Transform sketch files into valid C++ sources"
 
     def setup_arg_parser(self, parser):
         super(Preprocess, self).setup_arg_parser(parser)
         self.e.add_arduino_dist_arg(parser)
-        parser.add_argument('sketch', help='Input sketch file name')
-        parser.add_argument('-o', '--output', default='-', help='Output source file name (default: use stdout)')
+        parser.add_argument('sketch', nargs='+', help='Input sketch file names')
+        parser.add_argument('-o', '--output', default='-',
+                            help='Output source file or directory name (default: use stdout)')
+        parser.add_argument('--combine', default=False, action='store_true',
+                            help='Combine all sketches into a single source')
 
     def run(self, args):
-        if args.output == '-':
-            out = sys.stdout
-        else:
-            out = open(args.output, 'wt')
+        if args.combine:
+            sketches = [(path, open(path, 'rt').read()) for path in args.sketch]
+            output = args.output
+            if os.path.isdir(output):
+                basename = os.path.splitext(os.path.basename(args.sketch[0]))[0]
+                output = os.path.join(output, basename + '.cpp')
+            if output == '-':
+                sys.stdout.write(self.combine(sketches))
+            else:
+                with open(output, 'wt') as out:
+                    out.write(self.combine(sketches))
+            return
 
-        sketch = open(args.sketch, 'rt').read()
-
-        header = 'Arduino.h' if self.e.arduino_lib_version.major else 'WProgram.h'
-        out.write('#include <%s>\n' % header)
-        out.write('\n'.join(self.prototypes(sketch)))
-        out.write('\n#line 1 "%s"\n' % args.sketch)
-        out.write(sketch)
-
-    def prototypes(self, src):
-        src = self.collapse_braces(self.strip(src))
-        regex = re.compile("[\\w\\[\\]\\*]+\\s+[&\\[\\]\\*\\w\\s]+\\([&,\\[\\]\\*\\w\\s]*\\)(?=\\s*\\{)")
-        matches = regex.findall(src)
-        return [m + ';' for m in matches]
-
-    def collapse_braces(self, src):
+        if args.output == '-':
+            for sketch_path in args.sketch:
+                self.process(sketch_path, sys.stdout)
+            return
+
+        if len(args.sketch) == 1 and not os.path.isdir(args.output):
+            with open(args.output, 'wt') as out:
+                self.process(args.sketch[0], out)
+            return
+
+        if not os.path.isdir(args.output):
+            os.makedirs(args.output)
+        for sketch_path in args.sketch:
+            basename = os.path.splitext(os.path.basename(sketch_path))[0]
+            with open(os.path.join(args.output, basename + '.cpp'), 'wt') as out:
+                self.process(sketch_path, out)
+
+    @property
+    def header(self):
+        return 'Arduino.h' if self.e.arduino_lib_version.major else 'WProgram.h'
+
+    def process(self, sketch_path, out):
+        out.write(self.preprocess(open(sketch_path, 'rt').read(), sketch_path))
+
+    def preprocess(self, sketch, sketch_path):
         """
-        Remove the contents of all top-level curly brace pairs {}.
+        Return C++ source for a sketch read from `sketch_path'.
         """
-        result = []
-        nesting = 0;
-
-        for c in src:
-            if not nesting:
-                result.append(c)
-            if c == '{':
-                nesting += 1
-            elif c == '}':
-                nesting -= 1
-                result.append(c)
-        
-        return ''.join(result)
-
-    def strip(self, src):
+        return self.combine([(sketch_path, sketch)])
+
+    def combine(self, sketches):
         """
-        Strips comments, pre-processor directives, single- and double-quoted
-        strings from a string.
+        Return a single C++ source for (path, contents) pairs of sketches.
         """
-        # single-quoted character
-        p = "('.')"
-        
-        # double-quoted string
-        p += "|(\"(?:[^\"\\\\]|\\\\.)*\")"
-        
-        # single and multi-line comment
-        p += "|(//.*?$)|(/\\*[^*]*(?:\\*(?!/)[^*]*)*\\*/)"
-        
-        # pre-processor directive
-        p += "|" + "(^\\s*#.*?$)"
-
-        regex = re.compile(p, re.MULTILINE)
-        return regex.sub(' ', src)
+        prototypes = []
+        for sketch_path, sketch in sketches:
+            prototypes += self.prototypes(sketch)
+        parts = ['#include <%s>\n' % self.header, '\n'.join(prototypes)]
+        for sketch_path, sketch in sketches:
+            parts += ['\n#line 1 "%s"\n' % sketch_path, sketch]
+        return ''.join(parts)
+
+    def prototypes(self, src):
+        return ino.sketch.prototypes(src)
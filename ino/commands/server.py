@@ -0,0 +1,97 @@
+# -*- coding: utf-8; -*-
+
+import os
+import json
+import socket
+
+import ino.server
+
+from ino.commands.base import Command
+from ino.client import connect, request, socket_path, served_commands
+from ino.filters import colorize
+from ino.utils import user_cache_dir
+from ino.exc import Abort
+
+
+class Server(Command):
+    """
+    Control the ino server.
+
+    The server is a background process which has all ino modules loaded
+    and keeps environments of projects in memory. While it is running
+    `ino build', `ino preproc' and `ino list-models' are passed to it and
+    start without any delay for interpreter startup, imports and loading
+    of the environment. One server serves all projects of a user. It stops
+    by itself after a period without requests.
+
+    Set INO_NO_SERVER environment variable to run a command in the
+    current process anyway.
+
+    Available actions:
+
+        * start  -- start the server in background
+        * stop   -- stop the running server
+        * status -- tell whether the server is running
+    """
+
+    name = 'server'
+    help_line = "Start or stop the background ino server"
+
+    def setup_arg_parser(self, parser):
+        super(Server, self).setup_arg_parser(parser)
+        parser.add_argument('action', choices=['start', 'stop', 'status'], help='Action to perform')
+        parser.add_argument('--idle-timeout', metavar='SECONDS', type=int, default=600,
+                            help='Stop the server after this number of seconds\n'
+                                 'without requests (default: %(default)s)')
+        parser.add_argument('--foreground', default=False, action='store_true',
+                            help='Do not detach from the terminal')
+
+    def status(self):
+        sock = connect()
+        if sock is None:
+            return None
+        try:
+            request(sock, {'control': 'status'})
+            return json.loads(sock.makefile('rb').readline())
+        except (socket.error, ValueError):
+            return None
+        finally:
+            sock.close()
+
+    def run(self, args):
+        status = self.status()
+
+        if args.action == 'status':
+            if status is None:
+                print 'Server is not running'
+            else:
+                print 'Server is running with pid %(pid)d, uptime %(uptime)ds, ' \
+                      '%(served)d requests served' % status
+            return
+
+        if args.action == 'stop':
+            if status is None:
+                print 'Server is not running'
+                return
+            sock = connect()
+            request(sock, {'control': 'stop'})
+            sock.makefile('rb').readline()
+            sock.close()
+            print colorize('Server stopped', 'green')
+            return
+
+        if status is not None:
+            raise Abort("Server is running already with pid %d" % status['pid'])
+
+        server = ino.server.Server(idle_timeout=args.idle_timeout)
+        server.listen()
+        if args.foreground:
+            print colorize('Serving %s on %s' % (', '.join(served_commands), server.path), 'green')
+            server.serve()
+        elif ino.server.daemonize(user_cache_dir('server.log')):
+            try:
+                server.serve()
+            finally:
+                os._exit(0)
+        else:
+            print colorize('Server started on %s' % socket_path(), 'green')
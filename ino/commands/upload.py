@@ -11,6 +11,7 @@ from serial import Serial
 from serial.serialutil import SerialException
 
 from ino.commands.base import Command
+from ino.watch import PortWatcher
 from ino.exc import Abort
 
 
@@ -32,20 +33,30 @@ class Upload(Command):
         parser.add_argument('-p', '--serial-port', metavar='PORT',
                             help='Serial port to upload firmware to\nTry to guess if not specified')
 
+        parser.add_argument('--profile', metavar='PROFILE',
+                            help='Optimization profile the firmware was built with\n'
+                                 '(default: the profile of the last `ino build\')')
+
         self.e.add_board_model_arg(parser)
         self.e.add_arduino_dist_arg(parser)
 
     def discover(self):
-        self.e.find_tool('stty', ['stty'])
         if platform.system() == 'Linux':
-            self.e.find_arduino_tool('avrdude', ['hardware', 'tools'])
-            self.e.find_arduino_file('avrdude.conf', ['hardware', 'tools'])
+            avrdude_dirs = (['hardware', 'tools'], ['hardware', 'tools'])
         else:
-            self.e.find_arduino_tool('avrdude', ['hardware', 'tools', 'avr', 'bin'])
-            self.e.find_arduino_file('avrdude.conf', ['hardware', 'tools', 'avr', 'etc'])
+            avrdude_dirs = (['hardware', 'tools', 'avr', 'bin'], ['hardware', 'tools', 'avr', 'etc'])
+        self.e.find_all([
+            lambda: self.e.find_tool('stty', ['stty']),
+            lambda: self.e.find_arduino_tool('avrdude', avrdude_dirs[0]),
+            lambda: self.e.find_arduino_file('avrdude.conf', avrdude_dirs[1]),
+        ])
     
     def run(self, args):
         self.discover()
+        if not os.path.exists(self.e.hex_path):
+            raise Abort("%s doesn't exist. Build the firmware with `ino build' first" %
+                        self.e.hex_path)
+
         port = args.serial_port or self.e.guess_serial_port()
         board = self.e.board_model(args.board_model)
 
@@ -81,34 +92,23 @@ class Upload(Command):
         # deal with the fact that the COM port number changes from bootloader to
         # sketch.
         if board['bootloader']['path'] == "caterina":
-            caterina_port = None
-            before = self.e.list_serial_ports()
-            if port in before:
-                ser = Serial()
-                ser.port = port
-                ser.baudrate = 1200
-                ser.open()
-                ser.close()
-
-                # Scanning for available ports seems to open the port or
-                # otherwise assert DTR, which would cancel the WDT reset if
-                # it happened within 250 ms. So we wait until the reset should
-                # have already occured before we start scanning.
-                if platform.system() != 'Darwin':
-                    sleep(0.3)
-
-            elapsed = 0
-            enum_delay = 0.25
-            while elapsed < 10:
-                now = self.e.list_serial_ports()
-                diff = list(set(now) - set(before))
-                if diff:
-                    caterina_port = diff[0]
-                    break
-
-                before = now
-                sleep(enum_delay)
-                elapsed += enum_delay
+            # start watching before the reset, so that the bootloader port
+            # is noticed the moment it appears
+            watcher = PortWatcher(self.e.serial_port_patterns())
+            try:
+                if port in watcher.known:
+                    ser = Serial()
+                    ser.port = port
+                    ser.baudrate = 1200
+                    ser.open()
+                    ser.close()
+
+                # the watcher only stats device nodes and never opens them,
+                # so it can't assert DTR and cancel the WDT reset, and there
+                # is no need to wait for the reset before watching
+                caterina_port = watcher.wait(10)
+            finally:
+                watcher.close()
 
             if caterina_port == None:
                 raise Abort("Couldn’t find a Leonardo on the selected port. "
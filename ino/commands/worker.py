@@ -0,0 +1,56 @@
+# -*- coding: utf-8; -*-
+
+import multiprocessing
+
+import ino.distributed
+
+from ino.commands.base import Command
+from ino.filters import colorize
+
+
+class Worker(Command):
+    """
+    Serve compile jobs of `ino build --workers' run on other machines.
+
+    Sources are preprocessed by the machine running the build, so a worker
+    needs only the same version of AVR toolchain. Jobs built with another
+    compiler version are refused and compiled locally by the build.
+
+    There is no authentication, so a worker should be reachable only from
+    a trusted network. By default it listens on localhost only.
+    """
+
+    name = 'worker'
+    help_line = "Serve compile jobs for distributed builds"
+
+    def setup_arg_parser(self, parser):
+        super(Worker, self).setup_arg_parser(parser)
+        self.e.add_arduino_dist_arg(parser)
+        parser.add_argument('--bind', metavar='ADDRESS', default='127.0.0.1',
+                            help='Address to listen on, use 0.0.0.0 for all\n'
+                                 'interfaces (default: %(default)s)')
+        parser.add_argument('--port', metavar='PORT', type=int,
+                            default=ino.distributed.default_port,
+                            help='Port to listen on (default: %(default)s)')
+        parser.add_argument('-j', '--jobs', metavar='N', type=int, default=None,
+                            help='Number of compile jobs to run simultaneously\n'
+                                 '(default: number of CPUs)')
+        parser.add_argument('-v', '--verbose', default=False, action='store_true',
+                            help='Print commands being run')
+
+    def run(self, args):
+        compilers = {}
+        for tool_key, tool_binary in [('cc', 'avr-gcc'), ('cxx', 'avr-g++')]:
+            compilers[tool_binary] = self.e.find_arduino_tool(
+                tool_key, ['hardware', 'tools', 'avr', 'bin'],
+                items=[tool_binary], human_name=tool_binary)
+
+        jobs = args.jobs or multiprocessing.cpu_count()
+        server = ino.distributed.WorkerServer((args.bind, args.port), compilers, jobs,
+                                              verbose=args.verbose)
+        print colorize('Serving %d compile jobs at once on %s:%d' %
+                       (jobs, args.bind, args.port), 'green')
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
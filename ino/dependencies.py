@@ -0,0 +1,521 @@
+# -*- coding: utf-8; -*-
+
+import os.path
+import re
+import hashlib
+import pickle
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python < 2.7
+    from ordereddict import OrderedDict
+
+from multiprocessing.pool import ThreadPool
+
+from ino.filters import colorize
+from ino.sketch import tokenize
+
+
+class IncludeScanner(object):
+    """
+    Extracts #include directives from source files.
+
+    Sources are split into tokens by ino.sketch.tokenize, so that includes
+    within comments and string literals are left out. Conditional groups
+    are evaluated as far as possible without the preprocessor: `#if 0',
+    `#if 1', comparisons of a macro with a number, e.g. `#if ARDUINO >=
+    100', and `#ifdef', `#ifndef' and `#if [!]defined(...)', for macros
+    given in `defines' (i.e. by -D flags) or defined earlier in the same
+    file. Any other macro is assumed to be undefined by `#ifndef', as
+    include guards are, but could be defined by another header, so
+    includes within `#ifdef' of it and of any other condition are
+    optional. Optional includes are resolved, but don't make libraries
+    used.
+
+    Results are cached by file path. A cached entry is reused as is while
+    file mtime and size stay the same; otherwise the file is read and
+    parsed again only if its content digest changed.
+    """
+
+    regex = re.compile(r'[ \t]*#[ \t]*include[ \t]*([<"])([^>"\n]+)[>"]')
+    directive_regex = re.compile(r'[ \t]*#[ \t]*(\w+)[ \t]*(.*)', re.DOTALL)
+    constant_regex = re.compile(r'([01])[ \t]*(?:$|//|/\*)')
+    defined_regex = re.compile(r'(!?)[ \t]*defined[ \t]*(?:\([ \t]*(\w+)[ \t]*\)|(\w+))'
+                               r'[ \t]*(?:$|//|/\*)')
+    compare_regex = re.compile(r'(\w+)[ \t]*(==|!=|>=|<=|>|<)[ \t]*(\d+)[lLuU]*[ \t]*(?:$|//|/\*)')
+    macro_regex = re.compile(r'\w+')
+    value_regex = re.compile(r'[ \t]+([^ \t/]+)')
+    operators = {
+        '==': lambda a, b: a == b,
+        '!=': lambda a, b: a != b,
+        '>=': lambda a, b: a >= b,
+        '<=': lambda a, b: a <= b,
+        '>': lambda a, b: a > b,
+        '<': lambda a, b: a < b,
+    }
+
+    # states of conditional groups: taken, taken if a macro not defined in
+    # the file isn't defined elsewhere either, skipped, skipped since
+    # a previous group was taken, not known
+    TAKEN, ASSUMED, SKIPPED, NESTED, OPTIONAL = range(5)
+
+    def __init__(self, entries=None, defines=None):
+        # path -> (mtime, size, digest, [(delimiter, name, optional), ...])
+        self.entries = entries or {}
+        # macro -> value
+        self.defines = defines or {}
+
+    def scan(self, path):
+        st = os.stat(path)
+        entry = self.entries.get(path)
+        if entry and entry[:2] == (st.st_mtime, st.st_size):
+            return entry[3]
+
+        with open(path, 'rb') as f:
+            contents = f.read()
+
+        digest = hashlib.md5(contents).hexdigest()
+        if entry and entry[2] == digest:
+            includes = entry[3]
+        else:
+            includes = self.parse(contents)
+
+        self.entries[path] = (st.st_mtime, st.st_size, digest, includes)
+        return includes
+
+    def condition(self, name, rest, defined):
+        """
+        Return the state of a group starting with `#if', `#ifdef' or
+        `#ifndef' directive `name' followed by `rest'.
+        """
+        if name == 'if':
+            constant = self.constant_regex.match(rest)
+            if constant:
+                return self.TAKEN if constant.group(1) == '1' else self.SKIPPED
+            match = self.compare_regex.match(rest)
+            if match:
+                macro, operator, number = match.groups()
+                try:
+                    value = int(defined[macro].rstrip('lLuU'), 0)
+                except (KeyError, ValueError):
+                    return self.OPTIONAL
+                if self.operators[operator](value, int(number)):
+                    return self.TAKEN
+                return self.SKIPPED
+            match = self.defined_regex.match(rest)
+            if not match:
+                return self.OPTIONAL
+            name = 'ifndef' if match.group(1) else 'ifdef'
+            macro = match.group(2) or match.group(3)
+        else:
+            match = self.macro_regex.match(rest)
+            macro = match and match.group()
+
+        if name == 'ifdef':
+            return self.TAKEN if macro in defined else self.OPTIONAL
+        return self.SKIPPED if macro in defined else self.ASSUMED
+
+    def parse(self, contents):
+        """
+        Return [(delimiter, name, optional), ...] of #include directives
+        in `contents'.
+        """
+        includes = []
+        groups = []
+        defined = dict(self.defines)
+        for kind, text in tokenize(contents):
+            if kind != 'directive':
+                continue
+            match = self.directive_regex.match(text)
+            if not match:
+                continue
+            name, rest = match.groups()
+            skipped = groups and groups[-1] in (self.SKIPPED, self.NESTED)
+            optional = self.OPTIONAL in groups
+            if name in ('if', 'ifdef', 'ifndef'):
+                groups.append(self.NESTED if skipped else self.condition(name, rest, defined))
+            elif name in ('elif', 'else'):
+                if not groups:
+                    continue
+                if groups[-1] == self.TAKEN:
+                    groups[-1] = self.NESTED
+                elif groups[-1] == self.SKIPPED:
+                    groups[-1] = (self.TAKEN if name == 'else' else
+                                  self.condition('if', rest, defined))
+                elif groups[-1] == self.ASSUMED:
+                    groups[-1] = self.OPTIONAL
+            elif name == 'endif':
+                if groups:
+                    groups.pop()
+            elif skipped:
+                continue
+            elif name == 'include':
+                include = self.regex.match(text)
+                if include:
+                    includes.append(include.groups() + (optional,))
+            elif name in ('define', 'undef') and not optional:
+                macro = self.macro_regex.match(rest)
+                if macro and name == 'define':
+                    value = self.value_regex.match(rest, macro.end())
+                    defined[macro.group()] = value.group(1) if value else ''
+                elif macro:
+                    defined.pop(macro.group(), None)
+        return includes
+
+
+class HeaderIndex(object):
+    """
+    Persistent listings of include directories used to find headers
+    without probing every directory of the include path with stat().
+
+    A listing of a directory is read again only if mtime of the
+    directory changed, i.e. a file was added, removed or renamed in it.
+    """
+
+    version = 2
+
+    def __init__(self):
+        # real path of directory -> (mtime, [file names], [subdirectory names])
+        self.listings = {}
+        self.changed = False
+
+    def load(self, filepath):
+        try:
+            with open(filepath, 'rb') as f:
+                data = pickle.load(f)
+        except Exception:
+            return
+        if data.get('version') == self.version:
+            self.listings = data['listings']
+
+    def dump(self, filepath):
+        if not self.changed:
+            return
+        dirname = os.path.dirname(filepath)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_filepath = '%s.%d' % (filepath, os.getpid())
+        with open(tmp_filepath, 'wb') as f:
+            pickle.dump({'version': self.version, 'listings': self.listings},
+                        f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_filepath, filepath)
+        self.changed = False
+
+    def listing(self, d):
+        """
+        Return a tuple of sorted lists (file names, subdirectory names).
+        """
+        try:
+            mtime = os.stat(d).st_mtime
+        except OSError:
+            return [], []
+        # the index is shared by all projects, so relative paths such as
+        # `lib' can't be keys
+        key = os.path.realpath(d)
+        entry = self.listings.get(key)
+        if entry and entry[0] == mtime:
+            return entry[1], entry[2]
+
+        files, subdirs = [], []
+        for name in sorted(os.listdir(d)):
+            if name.startswith('.'):
+                continue
+            if os.path.isdir(os.path.join(d, name)):
+                subdirs.append(name)
+            else:
+                files.append(name)
+        self.listings[key] = (mtime, files, subdirs)
+        self.changed = True
+        return files, subdirs
+
+    def subdirs(self, d, recursive=False, exclude=()):
+        result = []
+        for name in self.listing(d)[1]:
+            if name in exclude:
+                continue
+            path = os.path.join(d, name)
+            result.append(path)
+            if recursive:
+                result.extend(self.subdirs(path, recursive, exclude))
+        return result
+
+    def table(self, dirs):
+        """
+        Return a dict mapping a file name to the first of `dirs' it's in.
+        """
+        table = {}
+        for d in dirs:
+            for filename in self.listing(d)[0]:
+                table.setdefault(filename, d)
+        return table
+
+    def find(self, dirs, name, table=None):
+        """
+        Find header `name' the way the compiler does for given include
+        directories. Return (path, include directory) or None. Plain file
+        names are looked up in `table' if given.
+        """
+        parts = name.split('/')
+        if len(parts) == 1:
+            if table is None:
+                table = self.table(dirs)
+            d = table.get(name)
+            return d and (os.path.normpath(os.path.join(d, name)), d)
+
+        for d in dirs:
+            path = d
+            for part in parts[:-1]:
+                if part == '..' or part == '.':
+                    path = os.path.join(path, part)
+                elif part in self.listing(path)[1]:
+                    path = os.path.join(path, part)
+                else:
+                    break
+            else:
+                if parts[-1] in self.listing(path)[0]:
+                    return os.path.normpath(os.path.join(d, name)), d
+        return None
+
+
+class DependencyGraph(object):
+    """
+    Graph of #include relations between project sources, headers and
+    libraries.
+
+    Includes are resolved the same way GCC does: a quoted include is looked
+    up in the directory of the including file and in its extra quote
+    directories first, then in the include directories in order. Headers
+    which are not found (e.g. toolchain headers) are not tracked.
+    """
+
+    version = 3
+
+    def __init__(self, lib_dirs, inc_dirs, quote_dirs=None, jobs=1, scanner=None, index=None):
+        self.lib_dirs = lib_dirs
+        self.inc_dirs = inc_dirs
+        self.quote_dirs = quote_dirs or (lambda path: [])
+        self.jobs = jobs or 1
+        # a scanner and an index could be shared by graphs with different
+        # include dirs
+        self.scanner = scanner or IncludeScanner()
+        self.index = index or HeaderIndex()
+
+        self.resolved = {}      # file path -> [included file paths]
+        self.required = {}      # file path -> set of paths included unconditionally
+        self.resolved_dirs = {} # file path -> [include dirs its includes are found in]
+        self.found = {}         # include name -> (file path, include dir) or None
+        self._table = None
+        self.libs = OrderedDict()   # library dir -> [used library dirs]
+        self.optional_libs = []     # libraries included optionally only
+
+        self._lib_prefixes = [(os.path.normpath(d) + os.path.sep, d) for d in lib_dirs]
+
+    def load(self, filepath):
+        if not os.path.exists(filepath):
+            return
+        try:
+            with open(filepath, 'rb') as f:
+                data = pickle.load(f)
+        except Exception:
+            return
+        if data.get('version') == self.version:
+            # entries scanned already in this run are fresher
+            for path, entry in data['files'].iteritems():
+                self.scanner.entries.setdefault(path, entry)
+
+    def dump(self, filepath):
+        tmp_filepath = '%s.%d' % (filepath, os.getpid())
+        with open(tmp_filepath, 'wb') as f:
+            pickle.dump({
+                'version': self.version,
+                'files': self.scanner.entries,
+            }, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_filepath, filepath)
+
+    def _lookup(self, dirs, name):
+        for d in dirs:
+            path = os.path.normpath(os.path.join(d, name))
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _resolve_file(self, path):
+        result = []
+        dirs = []
+        required = set()
+        for delimiter, name, optional in self.scanner.scan(path):
+            found = None
+            if delimiter == '"':
+                quote_dirs = [os.path.dirname(path)] + self.quote_dirs(path)
+                found = self._lookup(quote_dirs, name)
+            if not found:
+                if name not in self.found:
+                    if self._table is None:
+                        self._table = self.index.table(self.inc_dirs)
+                    self.found[name] = self.index.find(self.inc_dirs, name, self._table)
+                if self.found[name]:
+                    found, inc_dir = self.found[name]
+                    if inc_dir not in dirs:
+                        dirs.append(inc_dir)
+            if found and found not in result:
+                result.append(found)
+            if found and not optional:
+                required.add(found)
+        return result, dirs, required
+
+    def resolve(self, paths):
+        """
+        Resolve includes of given files and all files they include,
+        level by level, reading files of each level concurrently.
+        """
+        pool = ThreadPool(self.jobs) if self.jobs > 1 else None
+        try:
+            frontier = [p for p in paths if p not in self.resolved]
+            seen = set(frontier)
+            while frontier:
+                if pool:
+                    results = pool.map(self._resolve_file, frontier)
+                else:
+                    results = map(self._resolve_file, frontier)
+
+                next_frontier = []
+                for path, (includes, dirs, required) in zip(frontier, results):
+                    self.resolved[path] = includes
+                    self.resolved_dirs[path] = dirs
+                    self.required[path] = required
+                    for inc in includes:
+                        if inc not in self.resolved and inc not in seen:
+                            seen.add(inc)
+                            next_frontier.append(inc)
+                frontier = next_frontier
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    def headers(self, source, required=False):
+        """
+        Return all files included by `source' directly or indirectly, or
+        only the ones included unconditionally if `required' is true.
+        """
+        source = os.path.normpath(source)
+        result = []
+        seen = set([source])
+        stack = [source]
+        while stack:
+            path = stack.pop()
+            for inc in self.resolved.get(path, []):
+                if required and inc not in self.required.get(path, ()):
+                    continue
+                if inc not in seen:
+                    seen.add(inc)
+                    result.append(inc)
+                    stack.append(inc)
+        return result
+
+    def include_dirs(self, sources):
+        """
+        Return set of include directories needed to find all files
+        included by `sources' directly or indirectly.
+        """
+        result = set()
+        for source in sources:
+            source = os.path.normpath(source)
+            for path in [source] + self.headers(source):
+                result.update(self.resolved_dirs.get(path, []))
+        return result
+
+    def lib_of(self, path):
+        for prefix, lib in self._lib_prefixes:
+            if path.startswith(prefix):
+                return lib
+        return None
+
+    def scan(self, root, sources_of):
+        """
+        Find libraries used by sources of `root' directory, recursively.
+
+        `sources_of' is a function returning list of source file paths
+        for a given directory. Returns list of used library directories
+        ordered so that each library goes before libraries it depends on.
+        Libraries included optionally only are put to `optional_libs'.
+        Optional includes of libraries which are used anyway still order
+        them, e.g. a library including the core only within `#if'.
+        """
+        optional = []
+        optional_deps = {}
+        pending = [root]
+        while pending:
+            sources = OrderedDict((d, [os.path.normpath(s) for s in sources_of(d)])
+                                  for d in pending)
+            for d in pending:
+                print colorize('Scanning dependencies of ' + os.path.basename(d), 'cyan')
+            self.resolve([s for paths in sources.itervalues() for s in paths])
+
+            for d, paths in sources.iteritems():
+                deps = []
+                optional_deps[d] = []
+                for source in paths:
+                    required = set(self.headers(source, required=True))
+                    for header in self.headers(source):
+                        lib = self.lib_of(header)
+                        if not lib or lib == d:
+                            continue
+                        if header in required:
+                            if lib not in deps:
+                                deps.append(lib)
+                        elif lib not in optional_deps[d]:
+                            optional_deps[d].append(lib)
+                self.libs[d] = deps
+
+            pending = []
+            for d in sources:
+                for lib in self.libs[d]:
+                    if lib not in self.libs and lib not in pending:
+                        pending.append(lib)
+
+        used = set(self.libs) - set([root])
+        for d, libs in optional_deps.iteritems():
+            for lib in libs:
+                if lib in used:
+                    if lib not in self.libs[d]:
+                        self.libs[d].append(lib)
+                elif lib not in optional:
+                    optional.append(lib)
+        self.optional_libs = optional
+        return toposort(self.libs, self.libs[root])
+
+
+def toposort(graph, roots):
+    """
+    Order nodes reachable from `roots' so that every node goes before all
+    nodes it refers to in `graph'. Nodes of a circular reference are
+    ordered as they were discovered and a warning is printed.
+    """
+    result = []
+    done = set()
+    path = []
+
+    def visit(node):
+        if node in done:
+            return
+        if node in path:
+            cycle = path[path.index(node):] + [node]
+            print colorize('Warning: circular dependency between libraries: %s' %
+                           ' -> '.join(os.path.basename(n) for n in cycle), 'yellow')
+            return
+        path.append(node)
+        for dep in reversed(graph.get(node, [])):
+            visit(dep)
+        path.pop()
+        done.add(node)
+        result.append(node)
+
+    # nodes are visited in reverse so that independent ones keep
+    # their original relative order in the result
+    for node in reversed(roots):
+        visit(node)
+
+    result.reverse()
+    return result
@@ -0,0 +1,306 @@
+# -*- coding: utf-8; -*-
+
+"""
+Distributed compilation.
+
+Sources are preprocessed locally, so workers need neither the project
+nor the Arduino libraries, only the same version of the compiler. A job
+is sent to a worker over TCP as a JSON header line followed by the
+preprocessed source; the worker replies with a JSON header line followed
+by the compiled object.
+
+The module could also be run as a compiler launcher for generated
+Makefiles:
+
+    python -m ino.distributed host:port,... -- avr-g++ ... -o obj -c src
+"""
+
+import re
+import os
+import os.path
+import sys
+import json
+import shutil
+import random
+import socket
+import tempfile
+import threading
+import subprocess
+import SocketServer
+
+from ino.engine import run_command
+from ino.exc import Abort
+
+
+default_port = 3633
+
+# flags which are applied by the preprocessor and are not needed anymore
+preprocessor_flags = ['-I', '-D', '-U']
+preprocessor_flags_with_arg = ['-iquote', '-isystem', '-include']
+
+# flags a worker accepts: target, optimization, code generation, warning
+# and language options. Anything else could make the compiler load, run
+# or write arbitrary files on the worker, e.g. -fplugin, --specs, -MF,
+# -fdump-*, -save-temps or -Wa,...
+safe_flag_regex = re.compile(r"""
+(?:
+    -m[\w=.+-]+
+  | -O[0-3sgz]?
+  | -f(?:no-)?(?:
+        function-sections | data-sections | lto(?:=\w+)? | fat-lto-objects
+      | exceptions | rtti | threadsafe-statics | use-cxa-atexit | permissive
+      | pack-struct | short-enums | short-double | unsigned-char | signed-char
+      | unsigned-bitfields | signed-bitfields | inline-functions | inline-small-functions
+      | merge-constants | merge-all-constants | strict-aliasing | common
+      | split-wide-types | tree-scev-cprop | move-loop-invariants | keep-inline-functions
+      | diagnostics-color(?:=\w+)? | diagnostics-show-option
+    )
+  | -fdebug-prefix-map=[^=]+=\.
+  | -W[\w=+-]*
+  | -w
+  | -D\w+(?:=[\w.+-]*)?
+  | -std=(?:c|gnu|c\+\+|gnu\+\+)\w+
+  | -g(?:gdb)?[0-3]?
+  | -pedantic | -pedantic-errors | -ansi | -pipe
+)\Z
+""", re.VERBOSE)
+
+
+def is_safe_flag(flag):
+    return safe_flag_regex.match(flag) is not None
+
+
+def parse_address(address):
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        return address, default_port
+    try:
+        return host or 'localhost', int(port)
+    except ValueError:
+        raise Abort("Invalid worker address: %s" % address)
+
+
+def compiler_version(compiler, _versions={}):
+    if compiler not in _versions:
+        code, output = run_command([compiler, '-dumpversion'])
+        _versions[compiler] = output.strip() if code == 0 else None
+    return _versions[compiler]
+
+
+def language_of(source):
+    return 'c' if source.endswith('.c') else 'c++'
+
+
+def recv_message(f):
+    """
+    Read a message from a socket file: a JSON header and `size' bytes of
+    payload. Return (header, payload).
+    """
+    line = f.readline()
+    if not line:
+        raise IOError('Connection closed')
+    header = json.loads(line)
+    payload = f.read(header.get('size', 0))
+    if len(payload) != header.get('size', 0):
+        raise IOError('Connection closed')
+    return header, payload
+
+
+def send_message(sock, header, payload=''):
+    header = dict(header, size=len(payload))
+    sock.sendall(json.dumps(header) + '\n' + payload)
+
+
+def preprocess(command):
+    """
+    Run a preprocessor command and return (exit code, preprocessed source,
+    messages). Messages are kept apart, so that warnings don't end up in
+    the source.
+    """
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    preprocessed, messages = proc.communicate()
+    return proc.returncode, preprocessed, messages
+
+
+def split_command(command):
+    """
+    Split a compile command ending with `-o <object> -c <source>' into
+    (compiler, flags without preprocessor ones, object, source).
+    """
+    if len(command) < 5 or command[-4] != '-o' or command[-2] != '-c':
+        raise ValueError('Not a compile command: %s' % ' '.join(command))
+    flags = []
+    skip = False
+    for flag in command[1:-4]:
+        if skip:
+            skip = False
+        elif flag in preprocessor_flags_with_arg:
+            skip = True
+        elif not any(flag.startswith(f) for f in preprocessor_flags):
+            flags.append(flag)
+    return command[0], flags, command[-3], command[-1]
+
+
+class WorkerPool(object):
+    """
+    Sends compile jobs to remote workers. If no worker is available or a
+    worker fails to serve a job it is compiled locally.
+    """
+
+    timeout = 300
+
+    def __init__(self, addresses):
+        self.addresses = [parse_address(a) for a in addresses]
+        self.failed = set()
+        self.lock = threading.Lock()
+        self.next = random.randrange(len(self.addresses))
+
+    def pick(self):
+        with self.lock:
+            alive = [a for a in self.addresses if a not in self.failed]
+            if not alive:
+                return None
+            self.next = (self.next + 1) % len(alive)
+            return alive[self.next]
+
+    def run_command(self, command):
+        """
+        Drop-in replacement of ino.engine.run_command for compile
+        commands. Return (exit code, output).
+        """
+        try:
+            compiler, flags, obj, source = split_command(command)
+        except ValueError:
+            return run_command(command)
+
+        if not all(is_safe_flag(f) for f in flags):
+            # workers would refuse the job
+            return run_command(command)
+
+        address = self.pick()
+        if address is None:
+            return run_command(command)
+
+        code, preprocessed, messages = preprocess(command[:-4] + ['-E', source])
+        if code != 0:
+            # let the local compiler report errors
+            return run_command(command)
+
+        try:
+            code, output = self.send(address, compiler, flags, obj, source, preprocessed)
+            # e.g. #warning is reported by the preprocessor
+            return code, messages + output
+        except (IOError, socket.error, ValueError) as e:
+            with self.lock:
+                self.failed.add(address)
+            sys.stderr.write('Worker %s:%d failed (%s), compiling locally\n' %
+                             (address[0], address[1], e))
+            return run_command(command)
+
+    def send(self, address, compiler, flags, obj, source, preprocessed):
+        sock = socket.create_connection(address, self.timeout)
+        try:
+            send_message(sock, {
+                'compiler': os.path.basename(compiler),
+                'version': compiler_version(compiler),
+                'flags': flags,
+                'language': language_of(source),
+                'source': os.path.basename(source),
+            }, preprocessed)
+            header, payload = recv_message(sock.makefile('rb'))
+        finally:
+            sock.close()
+
+        if 'error' in header:
+            raise IOError(header['error'])
+        if header['code'] == 0:
+            with open(obj, 'wb') as f:
+                f.write(payload)
+        return header['code'], header['output']
+
+    def compile(self, target):
+        """
+        Runner for compile targets of the native build engine.
+        """
+        return self.run_command(target.command)
+
+
+class WorkerHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            header, payload = recv_message(self.rfile)
+            reply, obj = self.server.compile(header, payload)
+        except (IOError, ValueError, KeyError) as e:
+            reply, obj = {'error': str(e)}, ''
+        send_message(self.request, reply, obj)
+
+
+class WorkerServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    Compiles preprocessed sources sent by WorkerPool with the compilers
+    given in `compilers', a dict of tool name -> path, running at most
+    `jobs' compilers at once.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, compilers, jobs, verbose=False):
+        SocketServer.TCPServer.__init__(self, address, WorkerHandler)
+        self.compilers = compilers
+        self.slots = threading.Semaphore(jobs)
+        self.verbose = verbose
+
+    def compile(self, header, source):
+        compiler = self.compilers.get(header['compiler'])
+        if compiler is None:
+            return {'error': 'Unknown compiler %s' % header['compiler']}, ''
+        version = compiler_version(compiler)
+        if header['version'] != version:
+            return {'error': 'Compiler version mismatch: %s here, %s requested' %
+                             (version, header['version'])}, ''
+        flags = header['flags']
+        for flag in flags:
+            if not is_safe_flag(flag):
+                return {'error': 'Flag %s is not allowed' % flag}, ''
+
+        tmp_dir = tempfile.mkdtemp(prefix='ino-worker-')
+        try:
+            name = os.path.splitext(os.path.basename(header['source']))[0]
+            suffix = '.i' if header['language'] == 'c' else '.ii'
+            source_path = os.path.join(tmp_dir, name + suffix)
+            obj_path = os.path.join(tmp_dir, name + '.o')
+            with open(source_path, 'wb') as f:
+                f.write(source)
+
+            command = [compiler] + flags + ['-o', obj_path, '-c', source_path]
+            if self.verbose:
+                print ' '.join(command)
+            with self.slots:
+                code, output = run_command(command)
+
+            obj = ''
+            if code == 0:
+                with open(obj_path, 'rb') as f:
+                    obj = f.read()
+            return {'code': code, 'output': output}, obj
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main(argv):
+    """
+    Compiler launcher: run a compile command on one of the workers.
+    """
+    if len(argv) < 3 or argv[1] != '--':
+        sys.stderr.write('Usage: python -m ino.distributed host:port,... -- command\n')
+        return 2
+    pool = WorkerPool(argv[0].split(','))
+    code, output = pool.run_command(argv[2:])
+    sys.stdout.write(output)
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,253 @@
+# -*- coding: utf-8; -*-
+
+import os.path
+import subprocess
+import time
+import threading
+import Queue
+
+from multiprocessing.pool import ThreadPool
+
+from ino.filters import colorize
+from ino.trace import tracer
+from ino.exc import Abort
+
+
+class Target(object):
+    """
+    A file produced by a command from a list of inputs.
+
+    Inputs are either other targets or plain file paths. The command is a
+    command line as a list. If `runner' is given it is called with the
+    target instead of running the command as is and should return a tuple
+    (exit code, output) or None on success.
+    """
+
+    def __init__(self, path, inputs, command=None, runner=None, message=None, color='yellow'):
+        self.path = path
+        self.inputs = inputs
+        self.command = command
+        self.runner = runner
+        self.message = message
+        self.color = color
+
+    def input_paths(self):
+        return [getattr(i, 'path', i) for i in self.inputs]
+
+    def input_targets(self):
+        return [i for i in self.inputs if isinstance(i, Target)]
+
+    def __repr__(self):
+        return '<Target %s>' % self.path
+
+
+class Engine(object):
+    """
+    Builds a DAG of targets the way make does: a target is rebuilt if it
+    doesn't exist or any of its inputs is newer. Independent targets are
+    built simultaneously on a pool of `jobs' workers as soon as all their
+    input targets are ready. Output of every action is printed at once
+    when it finishes so that parallel jobs don't mix their lines.
+
+    Several engines may run at the same time in different threads. Then
+    `slots' is a semaphore shared by them to limit the total number of
+    running actions and `prefix' tells their output apart.
+
+    If `manifests' (see ino.manifest) are given, targets they cover are
+    checked by contents of inputs and commands instead of mtimes. If an
+    `explainer' (see ino.explain) is given, it is told why every target
+    was rebuilt.
+    """
+
+    output_lock = threading.Lock()
+
+    def __init__(self, jobs=1, verbose=False, slots=None, prefix=None, manifests=None,
+                 explainer=None):
+        self.jobs = jobs
+        self.verbose = verbose
+        self.slots = slots
+        self.prefix = prefix
+        self.manifests = manifests
+        self.explainer = explainer
+
+    def collect(self, goals):
+        """
+        Return all targets needed for `goals' in dependency order.
+        """
+        result = []
+        seen = set()
+        stack = [(goal, False) for goal in reversed(goals)]
+        while stack:
+            target, expanded = stack.pop()
+            if expanded:
+                result.append(target)
+                continue
+            if target in seen:
+                continue
+            seen.add(target)
+            stack.append((target, True))
+            stack.extend((t, False) for t in reversed(target.input_targets()))
+        return result
+
+    def stale_reason(self, target):
+        """
+        Return None if the target is up to date, otherwise a tuple
+        (cause, detail) telling why it is not (see ino.explain).
+        """
+        if not os.path.exists(target.path):
+            return 'missing', None
+        if self.manifests and self.manifests.has(target):
+            return self.manifests.explain(target)
+        mtime = os.path.getmtime(target.path)
+        for path in target.input_paths():
+            if not os.path.exists(path):
+                return 'removed', path
+            if os.path.getmtime(path) > mtime:
+                return 'newer', path
+        return None
+
+    def is_stale(self, target):
+        return self.stale_reason(target) is not None
+
+    def record(self, target):
+        if self.manifests and self.manifests.covers(target):
+            self.manifests.record(target)
+
+    def execute(self, target):
+        """
+        Run the action of a target. Return (exit code, output).
+        """
+        dirname = os.path.dirname(target.path)
+        if dirname and not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # created by a concurrent job
+                pass
+
+        if target.runner:
+            return target.runner(target) or (0, '')
+        return run_command(target.command)
+
+    def delete_partial(self, target, before):
+        """
+        Delete a target written by a failed action, which would look up to
+        date next time otherwise, like make does with .DELETE_ON_ERROR.
+        `before' is the mtime of the target before the action.
+        """
+        mtime = mtime_or_none(target.path)
+        if mtime is not None and mtime != before:
+            try:
+                os.remove(target.path)
+            except OSError:
+                pass
+
+    def process(self, target):
+        try:
+            reason = self.stale_reason(target)
+            if reason is None:
+                if self.manifests and not self.manifests.has(target):
+                    # built before manifests were kept
+                    self.record(target)
+                return target, None, None
+            before = mtime_or_none(target.path)
+            if self.slots:
+                self.slots.acquire()
+            try:
+                start = time.time()
+                result = self.execute(target)
+            except Exception:
+                self.delete_partial(target, before)
+                raise
+            finally:
+                if self.slots:
+                    self.slots.release()
+            end = time.time()
+            tracer.add(target.message or target.path, 'target', start, end)
+            if result[0] == 0:
+                self.record(target)
+                if self.explainer:
+                    self.explainer.add(target, reason, end - start)
+            else:
+                self.delete_partial(target, before)
+            return (target,) + result
+        except Exception as e:
+            return target, e, ''
+
+    def report(self, target, code, output):
+        lines = []
+        if target.message:
+            lines.append(colorize(target.message, target.color))
+        if self.verbose and target.command:
+            lines.append(' '.join(target.command))
+        if output:
+            lines.extend(output.rstrip('\n').split('\n'))
+        if self.prefix:
+            lines = [self.prefix + line for line in lines]
+        with self.output_lock:
+            for line in lines:
+                print line
+
+    def build(self, goals):
+        targets = self.collect(goals)
+        waiting = dict((t, len(set(t.input_targets()))) for t in targets)
+        dependants = dict((t, []) for t in targets)
+        for t in targets:
+            for dep in set(t.input_targets()):
+                dependants[dep].append(t)
+
+        ready = [t for t in targets if not waiting[t]]
+        done = Queue.Queue()
+        pool = ThreadPool(self.jobs)
+        running = 0
+        failed = None
+        try:
+            while ready or running:
+                while ready and not failed:
+                    pool.apply_async(self.process, (ready.pop(0),), callback=done.put)
+                    running += 1
+                if not running:
+                    break
+
+                # get() with a timeout to stay interruptible by Ctrl+C
+                target, code, output = done.get(True, 3600 * 24)
+                running -= 1
+                if code is None:
+                    # up to date
+                    pass
+                elif isinstance(code, Exception):
+                    failed = failed or "Building %s failed: %s" % (target.path, code)
+                    continue
+                else:
+                    self.report(target, code, output)
+                    if code != 0:
+                        failed = failed or "Building %s failed with code %s" % (target.path, code)
+                        continue
+
+                for t in dependants[target]:
+                    waiting[t] -= 1
+                    if not waiting[t]:
+                        ready.append(t)
+        finally:
+            pool.close()
+            pool.join()
+
+        if failed:
+            raise Abort(failed)
+
+
+def mtime_or_none(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def run_command(command):
+    """
+    Run a command and return a tuple (exit code, output). Both stdout and
+    stderr are captured into output.
+    """
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate()[0]
+    return proc.returncode, output
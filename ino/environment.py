@@ -4,10 +4,12 @@ import sys
 import os.path
 import itertools
 import argparse
-import pickle
+import json
+import stat
 import platform
 import hashlib
 import re
+import threading
 
 try:
     from collections import OrderedDict
@@ -18,8 +20,9 @@ except ImportError:
 from collections import namedtuple
 from glob import glob
 
+from ino.boards import BoardModels, load_board_models
 from ino.filters import colorize
-from ino.utils import format_available_options
+from ino.utils import user_cache_dir, utf8_dict
 from ino.exc import Abort
 
 
@@ -68,27 +71,99 @@ class Environment(dict):
         arduino_dist_dir_guesses.insert(0, '/Applications/Arduino.app/Contents/Resources/Java')
 
     default_board_model = 'uno'
+
+    # where serial ports are looked for, could be changed for testing
+    dev_dir = os.environ.get('INO_DEV_DIR', '/dev')
+
     ino = sys.argv[0]
 
+    output_lock = threading.Lock()
+
+    # version of the discovery cache format
+    discovery_version = 1
+
+    def __init__(self, *args, **kwargs):
+        super(Environment, self).__init__(*args, **kwargs)
+        # environments copied from another one share its discovery cache,
+        # so that whatever copies discover is dumped with the original
+        self.discovered = getattr(args[0], 'discovered', {}) if args else {}
+        self.discovery_state = getattr(args[0], 'discovery_state', None) if args else None
+        if self.discovery_state is None:
+            self.discovery_state = {'changed': False}
+
+    @property
+    def discovery_changed(self):
+        return self.discovery_state['changed']
+
+    @discovery_changed.setter
+    def discovery_changed(self, value):
+        self.discovery_state['changed'] = value
+
     def dump(self):
-        if not os.path.isdir(self.output_dir):
+        """
+        Save discovery results: found tools, directories and files, and
+        the Arduino software version. Anything else is computed by every
+        run of a command.
+        """
+        search_cache.dump()
+        if not self.discovery_changed or not os.path.isdir(self.output_dir):
             return
-        with open(self.dump_filepath, 'wb') as f:
-            pickle.dump(self.items(), f)
+        # several ino processes (e.g. `ino preproc' run by parallel make)
+        # may dump simultaneously, so never leave a partially written file
+        tmp_filepath = '%s.%d' % (self.dump_filepath, os.getpid())
+        with open(tmp_filepath, 'w') as f:
+            json.dump({'version': self.discovery_version, 'entries': self.discovered}, f)
+        os.rename(tmp_filepath, self.dump_filepath)
+        self.discovery_changed = False
 
     def load(self):
+        """
+        Load discovery results saved by dump(). They are not put into the
+        environment right away but checked when looked up (see cached()).
+        """
         if not os.path.exists(self.dump_filepath):
             return
-        with open(self.dump_filepath, 'rb') as f:
-            try:
-                self.update(pickle.load(f))
-            except:
-                print colorize('Environment dump exists (%s), but failed to load' % 
-                               self.dump_filepath, 'yellow')
+        try:
+            with open(self.dump_filepath) as f:
+                data = json.load(f, object_hook=utf8_dict)
+        except (IOError, ValueError):
+            print colorize('Discovery cache exists (%s), but failed to load' %
+                           self.dump_filepath, 'yellow')
+            return
+        if data.get('version') == self.discovery_version:
+            self.discovered.update(data['entries'])
 
     @property
     def dump_filepath(self):
-        return os.path.join(self.output_dir, 'environment.pickle')
+        return os.path.join(self.output_dir, 'discovery.json')
+
+    def cached(self, key, places=None):
+        """
+        Return a discovery result remembered for `key' if it was found in
+        the same `places' and files it was derived from are unchanged,
+        otherwise None.
+        """
+        entry = self.discovered.get(key)
+        if entry is None or entry['places'] != places:
+            return None
+        for path, fingerprint in entry['files']:
+            if file_fingerprint(path) != fingerprint:
+                return None
+        self[key] = entry['value']
+        return entry['value']
+
+    def remember(self, key, value, places=None, files=()):
+        """
+        Set `key' to a discovery result which is valid as long as it is
+        looked for in the same `places' and `files' are unchanged.
+        """
+        self[key] = value
+        self.discovered[key] = {
+            'value': value,
+            'places': places,
+            'files': [[path, file_fingerprint(path)] for path in files],
+        }
+        self.discovery_changed = True
 
     def __getitem__(self, key):
         try:
@@ -119,19 +194,71 @@ class Environment(dict):
         places = itertools.chain.from_iterable(os.path.expandvars(p).split(os.pathsep) for p in places)
         places = map(os.path.expanduser, places)
 
-        print 'Searching for', human_name, '...',
-        for p in places:
-            for i in items:
-                path = os.path.join(p, i)
-                if os.path.exists(path):
-                    result = path if join else p
-                    print colorize(result, 'green')
-                    self[key] = result
-                    return result
+        cache_key = [list(items), places, join]
+        result = self.cached(key, cache_key)
+        if result is not None:
+            return result
+        # a failed lookup is remembered too, e.g. for optional tools
+        missing_key = key + ':missing'
+        if self.cached(missing_key, cache_key):
+            raise Abort("%s not found. Searched in following places: %s" %
+                        (human_name, ''.join(['\n  - ' + p for p in places])))
+
+        result = search_cache.get(cache_key)
+        if result is None:
+            for p in places:
+                for i in items:
+                    path = os.path.join(p, i)
+                    if os.path.exists(path):
+                        result = path if join else p
+                        break
+                if result is not None:
+                    search_cache.set(cache_key, result)
+                    break
+
+        # lookups could run concurrently (see find_all), so print the
+        # whole line at once
+        with self.output_lock:
+            print 'Searching for', human_name, '...',
+            if result is not None:
+                print colorize(result, 'green')
+            else:
+                print colorize('FAILED', 'red')
+        if result is None:
+            # valid until any of the candidates appears
+            candidates = [os.path.join(p, i) for p in places for i in items]
+            self.remember(missing_key, True, cache_key, candidates)
+            raise Abort("%s not found. Searched in following places: %s" %
+                        (human_name, ''.join(['\n  - ' + p for p in places])))
+
+        self.remember(key, result, cache_key, [result])
+        return result
+
+    def find_all(self, lookups):
+        """
+        Run independent lookups, i.e. functions calling find_* methods, at
+        once. Return their results in order. If some lookups fail the
+        first error is raised after all of them finish.
+        """
+        results = [None] * len(lookups)
+        errors = [None] * len(lookups)
 
-        print colorize('FAILED', 'red')
-        raise Abort("%s not found. Searched in following places: %s" %
-                    (human_name, ''.join(['\n  - ' + p for p in places])))
+        def run(i, lookup):
+            try:
+                results[i] = lookup()
+            except Exception as e:
+                errors[i] = e
+
+        threads = [threading.Thread(target=run, args=(i, lookup))
+                   for i, lookup in enumerate(lookups)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for e in errors:
+            if e is not None:
+                raise e
+        return results
 
     def find_dir(self, key, items, places, human_name=None):
         return self._find(key, items or ['.'], places, human_name, join=False)
@@ -174,24 +301,7 @@ class Environment(dict):
         boards_txt = self.find_arduino_file('boards.txt', ['hardware', 'arduino'], 
                                             human_name='Board description file (boards.txt)')
 
-        self['board_models'] = BoardModels()
-        self['board_models'].default = self.default_board_model
-        with open(boards_txt) as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                multikey, val = line.split('=')
-                multikey = multikey.split('.')
-
-                subdict = self['board_models']
-                for key in multikey[:-1]:
-                    if key not in subdict:
-                        subdict[key] = {}
-                    subdict = subdict[key]
-
-                subdict[multikey[-1]] = val
-
+        self['board_models'] = load_board_models(boards_txt, self.default_board_model)
         return self['board_models']
 
     def board_model(self, key):
@@ -214,10 +324,12 @@ class Environment(dict):
     def serial_port_patterns(self):
         system = platform.system()
         if system == 'Linux':
-            return ['/dev/ttyACM*', '/dev/ttyUSB*']
-        if system == 'Darwin':
-            return ['/dev/tty.usbmodem*', '/dev/tty.usbserial*']
-        raise NotImplementedError("Not implemented for Windows")
+            names = ['ttyACM*', 'ttyUSB*']
+        elif system == 'Darwin':
+            names = ['tty.usbmodem*', 'tty.usbserial*']
+        else:
+            raise NotImplementedError("Not implemented for Windows")
+        return [os.path.join(self.dev_dir, name) for name in names]
 
     def list_serial_ports(self):
         ports = []
@@ -242,24 +354,76 @@ class Environment(dict):
     def process_args(self, args):
         arduino_dist = getattr(args, 'arduino_dist', None)
         if arduino_dist:
+            arduino_dist = os.path.abspath(arduino_dist)
             self['arduino_dist_dir'] = arduino_dist
 
         board_model = getattr(args, 'board_model', None)
-        if board_model:
+        board_models = board_model.split(',') if board_model else []
+        if getattr(args, 'all_models', False):
+            board_models = self.board_models().keys()
+        elif board_models:
             all_models = self.board_models()
-            if board_model not in all_models:
-                print "Supported Arduino board models are:"
-                print all_models.format()
-                raise Abort('%s is not a valid board model' % board_model)
+            for model in board_models:
+                if model not in all_models:
+                    print "Supported Arduino board models are:"
+                    print all_models.format()
+                    raise Abort('%s is not a valid board model' % model)
+            if len(board_models) > 1 and not hasattr(args, 'all_models'):
+                raise Abort('Only one board model could be given')
 
         # Build artifacts for each Arduino distribution / Board model
         # pair should go to a separate subdirectory
-        build_dirname = board_model or self.default_board_model
-        if arduino_dist:
-            hash = hashlib.md5(arduino_dist).hexdigest()[:8]
-            build_dirname = '%s-%s' % (build_dirname, hash)
+        # as well as artifacts of every optimization profile
+        profile = getattr(args, 'profile', None)
+        # commands using a build (e.g. upload) take the profile of the
+        # last build unless it is given explicitly
+        last_profiles = self.last_profiles() if hasattr(args, 'profile') and not profile else {}
+        self['build_dirs'] = OrderedDict()
+        self['build_profiles'] = {}
+        for model in board_models or [self.default_board_model]:
+            key = model
+            if arduino_dist:
+                hash = hashlib.md5(arduino_dist).hexdigest()[:8]
+                key = '%s-%s' % (key, hash)
+            model_profile = profile or last_profiles.get(key, 'default')
+            self['build_profiles'][key] = model_profile
+            build_dirname = model
+            if model_profile != 'default':
+                build_dirname = '%s-%s' % (build_dirname, model_profile)
+            if arduino_dist:
+                build_dirname = '%s-%s' % (build_dirname, hash)
+            self['build_dirs'][model] = os.path.join(self.output_dir, build_dirname)
+
+        self['build_dir'] = self['build_dirs'].values()[0]
+
+    @property
+    def profiles_filepath(self):
+        return os.path.join(self.output_dir, 'profiles.json')
 
-        self['build_dir'] = os.path.join(self.output_dir, build_dirname)
+    def last_profiles(self):
+        """
+        Return a dict mapping a board model (with a hash of the Arduino
+        distribution if one was given) to the optimization profile it was
+        last built with.
+        """
+        try:
+            with open(self.profiles_filepath) as f:
+                return json.load(f, object_hook=utf8_dict)
+        except (IOError, ValueError):
+            return {}
+
+    def remember_profiles(self):
+        """
+        Record profiles of the current build for commands run later.
+        """
+        if not os.path.isdir(self.output_dir):
+            return
+        profiles = self.last_profiles()
+        profiles.update(self['build_profiles'])
+        tmp_filepath = '%s.%d' % (self.profiles_filepath, os.getpid())
+        with open(tmp_filepath, 'w') as f:
+            json.dump(profiles, f)
+        os.rename(tmp_filepath, self.profiles_filepath)
 
     @property
     def arduino_lib_version(self):
@@ -267,17 +431,95 @@ class Environment(dict):
                                human_name='Arduino lib version file (version.txt)')
 
         if 'arduino_lib_version' not in self:
+            v = self.cached('arduino_lib_version', [self['version.txt']])
+            if v is not None:
+                self['arduino_lib_version'] = Version(*v)
+                return self['arduino_lib_version']
+
             with open(self['version.txt']) as f:
                 print 'Detecting Arduino software version ... ',
                 v_string = f.read().strip()
                 v = Version.parse(v_string)
-                self['arduino_lib_version'] = v
+                self.remember('arduino_lib_version', v, [self['version.txt']], [self['version.txt']])
                 print colorize("%s (%s)" % (v, v_string), 'green')
 
         return self['arduino_lib_version']
 
 
-class BoardModels(OrderedDict):
-    def format(self):
-        map = [(key, val['name']) for key, val in self.iteritems()]
-        return format_available_options(map, head_width=12, default=self.default)
+class SearchCache(object):
+    """
+    Per-user cache of paths found by Environment._find shared by all
+    projects. Entries are keyed by what was searched for and where, i.e.
+    with expanded distribution directory and $PATH, and are valid as long
+    as the found path exists.
+    """
+
+    version = 1
+
+    def __init__(self):
+        self.entries = None
+        self.new_entries = {}
+
+    @property
+    def filepath(self):
+        return user_cache_dir('search.json')
+
+    def load(self):
+        self.entries = {}
+        try:
+            with open(self.filepath) as f:
+                data = json.load(f, object_hook=utf8_dict)
+        except (IOError, ValueError):
+            return
+        if data.get('version') == self.version:
+            self.entries = data['entries']
+
+    def get(self, key):
+        if self.entries is None:
+            self.load()
+        path = self.entries.get(json.dumps(key))
+        if path is None or not os.path.exists(path):
+            return None
+        return path
+
+    def set(self, key, path):
+        self.entries[json.dumps(key)] = path
+        self.new_entries[json.dumps(key)] = path
+
+    def dump(self):
+        """
+        Add new entries to the cache file, keeping entries written by
+        other processes in the meantime.
+        """
+        if not self.new_entries:
+            return
+        self.load()
+        self.entries.update(self.new_entries)
+        self.new_entries = {}
+        try:
+            dirname = os.path.dirname(self.filepath)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            tmp_filepath = '%s.%d' % (self.filepath, os.getpid())
+            with open(tmp_filepath, 'w') as f:
+                json.dump({'version': self.version, 'entries': self.entries}, f)
+            os.rename(tmp_filepath, self.filepath)
+        except (IOError, OSError):
+            pass
+
+
+search_cache = SearchCache()
+
+
+def file_fingerprint(path):
+    """
+    Return [mtime, size] of a regular file, True for another existing
+    path (e.g. a directory) and None if the path does not exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if stat.S_ISREG(st.st_mode):
+        return [st.st_mtime, st.st_size]
+    return True
@@ -0,0 +1,98 @@
+# -*- coding: utf-8; -*-
+
+import os.path
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python < 2.7
+    from ordereddict import OrderedDict
+
+from ino.filters import colorize
+
+
+# causes of rebuilds which refer to an input that may be a rebuilt target
+input_causes = ['changed', 'newer', 'rebuilt']
+
+
+def relpath(path):
+    return os.path.relpath(path) if os.path.isabs(path) else path
+
+
+def describe(reason):
+    """
+    Human readable form of a (cause, detail) tuple returned by
+    Engine.stale_reason.
+    """
+    cause, detail = reason
+    if cause == 'missing':
+        return 'target does not exist'
+    if cause == 'changed':
+        return '%s changed' % relpath(detail)
+    if cause == 'newer':
+        return '%s is newer' % relpath(detail)
+    if cause == 'rebuilt':
+        return '%s was rebuilt' % relpath(detail)
+    if cause == 'added':
+        return 'new input %s' % relpath(detail)
+    if cause == 'removed':
+        return 'input %s is gone' % relpath(detail)
+    if cause == 'command':
+        added, removed = detail
+        changes = []
+        if added:
+            changes.append('added ' + ' '.join(added))
+        if removed:
+            changes.append('removed ' + ' '.join(removed))
+        return 'flags changed: %s' % '; '.join(changes) if changes else 'command changed'
+    return 'unknown reason'
+
+
+class Explainer(object):
+    """
+    Collects why targets were rebuilt and how long each took. A target
+    rebuilt because one of its inputs was rebuilt gets the root cause of
+    that input, so that totals point at what actually started a chain of
+    rebuilds: a touched header, changed flags or a regenerated sketch.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rebuilt = OrderedDict()    # target path -> (reason, root cause, seconds)
+
+    def add(self, target, reason, seconds):
+        cause = reason
+        with self.lock:
+            if reason[0] in input_causes and reason[1] in self.rebuilt:
+                cause = self.rebuilt[reason[1]][1]
+            self.rebuilt[target.path] = (reason, cause, seconds)
+
+    def causes(self):
+        """
+        Return a list of (description, number of targets, total seconds)
+        for every root cause, most expensive first.
+        """
+        totals = OrderedDict()
+        for reason, cause, seconds in self.rebuilt.itervalues():
+            count, total = totals.get(describe(cause), (0, 0))
+            totals[describe(cause)] = (count + 1, total + seconds)
+        causes = [(name, count, total) for name, (count, total) in totals.iteritems()]
+        return sorted(causes, key=lambda c: c[2], reverse=True)
+
+    def lines(self, prefix=''):
+        lines = []
+        if not self.rebuilt:
+            lines.append(colorize('Nothing was rebuilt', 'cyan'))
+        else:
+            lines.append(colorize('Rebuilt targets:', 'cyan'))
+            for path, (reason, cause, seconds) in self.rebuilt.iteritems():
+                line = '%8.2fs  %s: %s' % (seconds, relpath(path), describe(reason))
+                if cause != reason:
+                    line += ' <- ' + describe(cause)
+                lines.append(line)
+            lines.append(colorize('Time by cause:', 'cyan'))
+            for name, count, total in self.causes():
+                lines.append('%8.2fs  %3d target%s  %s' %
+                             (total, count, '' if count == 1 else 's', name))
+        return [prefix + line for line in lines]
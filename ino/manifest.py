@@ -0,0 +1,118 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import hashlib
+import pickle
+
+
+class Manifests(object):
+    """
+    Records for every built target the exact command it was built with
+    and digests of contents of all its inputs. A target is up to date if
+    both are the same as recorded, whatever mtimes of files are, so that
+    checking out another branch and back, touching files or restoring the
+    build directory from a cache doesn't cause rebuilds.
+
+    Only targets within `root' directory are covered. Digests of files
+    are cached and computed again only when file mtime or size changes.
+    """
+
+    version = 1
+
+    def __init__(self, root, filepath=None):
+        self.root = os.path.join(os.path.normpath(root), '')
+        self.filepath = filepath or os.path.join(root, 'manifests.pickle')
+        self.manifests = {}     # target path -> (command, [(input path, digest), ...])
+        self.digests = {}       # file path -> (mtime, size, digest)
+        self.changed = False
+
+    def load(self):
+        try:
+            with open(self.filepath, 'rb') as f:
+                data = pickle.load(f)
+        except Exception:
+            return
+        if data.get('version') == self.version:
+            self.manifests = data['manifests']
+            self.digests = data['digests']
+
+    def dump(self):
+        if not self.changed:
+            return
+        tmp_filepath = '%s.%d' % (self.filepath, os.getpid())
+        with open(tmp_filepath, 'wb') as f:
+            pickle.dump({
+                'version': self.version,
+                'manifests': self.manifests,
+                'digests': self.digests,
+            }, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_filepath, self.filepath)
+        self.changed = False
+
+    def covers(self, target):
+        return os.path.normpath(target.path).startswith(self.root)
+
+    def digest(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        entry = self.digests.get(path)
+        if entry and entry[:2] == (st.st_mtime, st.st_size):
+            return entry[2]
+
+        h = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), ''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self.digests[path] = (st.st_mtime, st.st_size, digest)
+        self.changed = True
+        return digest
+
+    def manifest(self, target):
+        return (list(target.command or []),
+                [(path, self.digest(path)) for path in target.input_paths()])
+
+    def has(self, target):
+        return target.path in self.manifests
+
+    def explain(self, target):
+        """
+        Return None if the target exists and was built from the same inputs
+        with the same command, otherwise a tuple (cause, detail) telling
+        what differs (see ino.explain).
+        """
+        if not os.path.exists(target.path):
+            return 'missing', None
+        if target.path not in self.manifests:
+            return 'unknown', None
+        command, inputs = self.manifests[target.path]
+        new_command, new_inputs = self.manifest(target)
+
+        digests = dict(inputs)
+        for path, digest in new_inputs:
+            if path not in digests:
+                return 'added', path
+            if digests[path] != digest:
+                return 'changed', path
+        paths = set(path for path, digest in new_inputs)
+        for path, digest in inputs:
+            if path not in paths:
+                return 'removed', path
+
+        if command != new_command:
+            added = tuple(f for f in new_command if f not in command)
+            removed = tuple(f for f in command if f not in new_command)
+            return 'command', (added, removed)
+        return None
+
+    def is_current(self, target):
+        return self.explain(target) is None
+
+    def record(self, target):
+        manifest = self.manifest(target)
+        if self.manifests.get(target.path) != manifest:
+            self.manifests[target.path] = manifest
+            self.changed = True
@@ -18,49 +18,67 @@ or mercurial do. The full list is provided below. You may run any of them with
 import sys
 import os.path
 import argparse
-import inspect
 
 import ino.commands
 
-from ino.commands.base import Command
-from ino.conf import configure
 from ino.exc import Abort
 from ino.filters import colorize
 from ino.environment import Environment
+from ino.trace import tracer
 from ino.argparsing import FlexiFormatter
 
 
-def main():
-    e = Environment()
-    e.load()
-
-    conf = configure()
+def main(argv=None, e=None):
+    """
+    Run ino command given by `argv' (sys.argv[1:] by default). An already
+    loaded environment could be passed as `e'.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    loaded = e is not None
 
     try:
-        current_command = sys.argv[1]
+        current_command = argv[0]
     except IndexError:
         current_command = None
 
+    # only the module of the command being run is imported (see
+    # ino.commands), other commands are just listed
     parser = argparse.ArgumentParser(prog='ino', formatter_class=FlexiFormatter, description=__doc__)
     subparsers = parser.add_subparsers()
-    is_command = lambda x: inspect.isclass(x) and issubclass(x, Command) and x != Command
-    commands = [cls(e) for _, cls in inspect.getmembers(ino.commands, is_command)]
-    for cmd in commands:
-        p = subparsers.add_parser(cmd.name, formatter_class=FlexiFormatter, help=cmd.help_line)
-        if current_command != cmd.name:
+    for info in ino.commands.registry:
+        p = subparsers.add_parser(info.name, formatter_class=FlexiFormatter, help=info.help_line)
+        if current_command != info.name:
             continue
+
+        if e is None:
+            e = Environment()
+        cmd = info.load()(e)
         cmd.setup_arg_parser(p)
+
+        # configuration is read only when a command is run
+        from ino.conf import configure
+        with tracer.phase('read configuration'):
+            conf = configure()
         p.set_defaults(func=cmd.run, **conf.as_dict(cmd.name))
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    # `ino --help' or `ino <command> --help' exits above without loading
+    # the environment
+    if not loaded:
+        with tracer.phase('load environment'):
+            e.load()
 
     try:
-        e.process_args(args)
+        with tracer.phase('process arguments'):
+            e.process_args(args)
 
-        if current_command not in 'clean init' and not os.path.isdir(e.build_dir):
+        if current_command not in ('clean', 'init', 'cache', 'server', 'worker') and not os.path.isdir(e.build_dir):
             os.makedirs(e.build_dir)
 
-        args.func(args)
+        with tracer.phase(current_command, 'command'):
+            args.func(args)
     except Abort as exc:
         print colorize(str(exc), 'red')
         sys.exit(1)
@@ -68,3 +86,6 @@ def main():
         print 'Terminated by user'
     finally:
         e.dump()
+        if getattr(args, 'trace', None):
+            tracer.dump(args.trace)
+            tracer.summary()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import sys
+import json
+import time
+import errno
+import select
+import socket
+import traceback
+
+import ino.commands
+import ino.runner
+
+from ino.client import socket_path, exit_marker, is_private
+from ino.environment import Environment
+from ino.exc import Abort
+from ino.trace import tracer
+
+
+class TerminalFile(object):
+    """
+    Output file of a served command. Tells it is a terminal if the client
+    output is, so that colorized output stays as is.
+    """
+
+    def __init__(self, fd, tty):
+        self.file = os.fdopen(fd, 'w', 0)
+        self.tty = tty
+
+    def isatty(self):
+        return self.tty
+
+    def __getattr__(self, attr):
+        return getattr(self.file, attr)
+
+
+class Server(object):
+    """
+    Serves ino commands over a Unix domain socket.
+
+    The server process has all modules imported and keeps loaded project
+    environments (the discovery dump) and board models of boards.txt found
+    at default places in memory. Each
+    request is handled in a process forked from the server, so it starts
+    warm, while whatever the command does to its process state doesn't
+    affect the server or other requests. Output of the command, including
+    output of tools it runs, goes to the client through the socket as is.
+
+    The server exits after `idle_timeout' seconds without requests.
+    """
+
+    def __init__(self, path=None, idle_timeout=600):
+        self.path = path or socket_path()
+        self.idle_timeout = idle_timeout
+        self.environments = {}  # project dir -> (dump mtime, Environment)
+        self.children = set()
+        self.started = time.time()
+        self.served = 0
+
+    def listen(self):
+        # commands are imported lazily by ino.runner, import them once
+        # here so that requests start warm, and so is jinja2 which is
+        # imported by the make engine on first use
+        ino.commands.load_all()
+        import jinja2
+        import jinja2.runtime
+        import jinja2.ext
+        dirname = os.path.dirname(self.path)
+        if not os.path.lexists(dirname):
+            os.makedirs(dirname, 0700)
+        # anyone could have created the directory in /tmp first
+        if not is_private(dirname, directory=True):
+            raise Abort('%s should be a directory owned by the current user with '
+                        'mode 0700' % dirname)
+        if os.path.lexists(self.path):
+            if not is_private(self.path):
+                raise Abort('%s is not owned by the current user' % self.path)
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        self.sock.listen(16)
+
+    def serve(self):
+        last_request = time.time()
+        try:
+            while True:
+                self.reap()
+                if self.children:
+                    last_request = time.time()
+                timeout = last_request + self.idle_timeout - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    ready = select.select([self.sock], [], [], min(timeout, 1))[0]
+                except select.error as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if not ready:
+                    continue
+                conn = self.sock.accept()[0]
+                last_request = time.time()
+                try:
+                    if self.handle(conn) == 'stop':
+                        break
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    conn.close()
+        finally:
+            self.sock.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def reap(self):
+        for pid in list(self.children):
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    self.children.discard(pid)
+            except OSError:
+                self.children.discard(pid)
+
+    def handle(self, conn):
+        message = json.loads(conn.makefile('rb', 0).readline())
+        control = message.get('control')
+        if control == 'stop':
+            conn.sendall('stopping\n')
+            return 'stop'
+        if control == 'status':
+            conn.sendall(json.dumps({
+                'pid': os.getpid(),
+                'uptime': time.time() - self.started,
+                'served': self.served,
+                'running': len(self.children),
+            }) + '\n')
+            return
+
+        # trace every request afresh, loading of its environment included,
+        # so that events of previous requests don't pile up
+        tracer.reset()
+        e = self.environment(message['cwd'])
+        pid = os.fork()
+        if pid == 0:
+            self.run_child(conn, message, e)
+        self.children.add(pid)
+        self.served += 1
+
+    def environment(self, cwd):
+        """
+        Return environment of the project loaded from its dump, which is
+        read again only if changed since the last request.
+        """
+        os.chdir(cwd)
+        try:
+            mtime = os.path.getmtime(Environment().dump_filepath)
+        except OSError:
+            mtime = None
+        cached = self.environments.get(cwd)
+        if not cached or cached[0] != mtime:
+            e = Environment()
+            e.load()
+            cached = self.environments[cwd] = (mtime, e)
+            # load board models in advance so that requests inherit them,
+            # see ino.boards.load_board_models. A copy of the environment
+            # is used since a request could be given another distribution
+            try:
+                Environment(e).board_models()
+            except Abort:
+                pass
+        return cached[1]
+
+    def run_child(self, conn, message, e):
+        code = 1
+        try:
+            os.setpgrp()
+            self.sock.close()
+            conn.sendall('%d\n' % os.getpid())
+
+            fd = conn.fileno()
+            null = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(null, 0)
+            os.dup2(fd, 1)
+            os.dup2(fd, 2)
+            if null > 2:
+                os.close(null)
+            sys.stdout = TerminalFile(1, message['tty'])
+            sys.stderr = TerminalFile(2, message['tty'])
+
+            os.environ.clear()
+            os.environ.update(message['env'])
+            sys.argv = ['ino'] + message['argv']
+
+            try:
+                ino.runner.main(message['argv'], e)
+                code = 0
+            except SystemExit as exc:
+                if exc.code is None:
+                    code = 0
+                elif isinstance(exc.code, int):
+                    code = exc.code
+                else:
+                    print >>sys.stderr, exc.code
+            except Exception:
+                traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                conn.sendall('%s%d' % (exit_marker, code))
+            finally:
+                os._exit(code)
+
+
+def daemonize(log_path):
+    """
+    Detach from the terminal with double fork. Return True in the daemon
+    process and False in the original one.
+    """
+    if os.fork():
+        return False
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+
+    dirname = os.path.dirname(log_path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    null = os.open(os.devnull, os.O_RDONLY)
+    log = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0600)
+    os.dup2(null, 0)
+    os.dup2(log, 1)
+    os.dup2(log, 2)
+    # not to be inherited by requests and tools they run
+    for fd in (null, log):
+        if fd > 2:
+            os.close(fd)
+    return True
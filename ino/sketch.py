@@ -0,0 +1,175 @@
+# -*- coding: utf-8; -*-
+
+"""
+Prototype extraction for sketch preprocessing.
+
+The sketch is split into C/C++ tokens in a single pass, so that comments,
+string, raw string and character literals and preprocessor lines are
+recognized exactly once and never confused with each other. Tokens at
+the top level, with contents of braces left out, are joined back into
+text which is scanned for function definitions in a single pass as
+well. Both steps take linear time, however large initializers or
+embedded assets a sketch has.
+
+Prototypes are the same as the ones found by the former regex based
+implementation: a return type and a name made of words, `*', `&', `[]'
+and whitespace, followed by a parameter list of the same characters and
+commas, followed by an opening brace.
+"""
+
+import re
+
+
+token_regex = re.compile(r"""
+    (?P<directive>
+        ^[ \t]*\#[^\n\\]*(?:\\.[^\n\\]*)*
+    )
+  | (?P<comment>
+        //[^\n\\]*(?:\\.[^\n\\]*)*
+      | /\*(?:.*?\*/|.*)
+    )
+  | (?P<string>
+        "[^"\\\n]*(?:\\.[^"\\\n]*)*"?
+    )
+  | (?P<char>
+        '[^'\\\n]*(?:\\.[^'\\\n]*)*'?
+    )
+  | (?P<code>
+        (?:
+            [^{}"'/\n]+
+          | \n(?![ \t]*\#)
+          | (?<=[0-9])'(?=[0-9A-Za-z_])
+        )+
+    )
+  | (?P<other>
+        .
+    )
+""", re.VERBOSE | re.DOTALL | re.MULTILINE)
+
+raw_prefix_regex = re.compile(r'(?<![0-9A-Za-z_])(?:u8|u|U|L)?R$')
+raw_regex = re.compile(r'"(?P<delim>[^()\\\s"]{0,16})\((?:.*?\)(?P=delim)"|.*)', re.DOTALL)
+
+
+# kinds of tokens replaced by a space in the top level text
+blank_kinds = frozenset(['comment', 'raw', 'string', 'char', 'directive'])
+
+
+def tokenize(src):
+    """
+    Generate (kind, text) tokens of a C/C++ source. Kinds are `directive'
+    (a preprocessor line with continuations), `comment', `raw' (a raw
+    string literal), `string', `char', `code' (a run of anything else but
+    braces and `/', digit separators included, up to a directive) and
+    `other' (any other single character).
+
+    Only the few characters which may start a literal, a comment or
+    a directive split the source, so tokens are long and the whole
+    source is processed by the regular expression engine in a single
+    pass.
+    """
+    pos = 0
+    n = len(src)
+    while pos < n:
+        for match in token_regex.finditer(src, pos):
+            kind = match.lastgroup
+            text = match.group()
+            pos = match.end()
+
+            if kind == 'code' and pos < n and src[pos] == '"':
+                prefix = raw_prefix_regex.search(text)
+                # not a raw string if the delimiter is malformed, e.g. if
+                # R is a macro expanding to a string
+                raw = prefix and raw_regex.match(src, pos)
+                if raw:
+                    if prefix.start():
+                        yield 'code', text[:prefix.start()]
+                    yield 'raw', prefix.group() + raw.group()
+                    pos = raw.end()
+                    break
+
+            yield kind, text
+        else:
+            break
+
+
+def top_level(tokens):
+    """
+    Return text of tokens outside of curly braces with comments, literals
+    and preprocessor directives replaced by spaces. Braces themselves are
+    kept, so `void f() { ... }' becomes `void f() {}'.
+    """
+    result = []
+    nesting = 0
+    for kind, text in tokens:
+        if kind == 'other' and text == '{':
+            if not nesting:
+                result.append('{')
+            nesting += 1
+        elif kind == 'other' and text == '}':
+            if nesting:
+                nesting -= 1
+            if not nesting:
+                result.append('}')
+        elif not nesting:
+            result.append(' ' if kind in blank_kinds else text)
+    return ''.join(result)
+
+
+WORD = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_')
+SPACE = frozenset(' \t\n\r\f\v')
+# characters of a return type and a name
+HEAD = WORD | frozenset('[]*')
+# characters of a declarator, i.e. everything before the parameter list
+DECL = HEAD | SPACE | frozenset('&')
+# characters of a parameter list
+PARAMS = DECL | frozenset(',')
+
+
+def find_prototypes(text):
+    """
+    Return definitions of functions found in top level text as produced
+    by top_level(), without bodies, e.g. ['void setup()', 'int f(int a)'].
+    """
+    result = []
+    n = len(text)
+    start = 0           # start of the current run of DECL characters
+    head = None         # start of the prototype within the run
+    i = 0
+    while i < n:
+        c = text[i]
+        if c in DECL:
+            if head is None and c in HEAD and (i == start or text[i - 1] not in HEAD):
+                # a word ending with whitespace starts the prototype
+                j = i
+                while j < n and text[j] in HEAD:
+                    j += 1
+                if j < n and text[j] in SPACE:
+                    head = (i, j)
+                i = j
+                continue
+            i += 1
+            continue
+
+        if c == '(' and head is not None and i - head[1] >= 2:
+            j = i + 1
+            while j < n and text[j] in PARAMS:
+                j += 1
+            if j < n and text[j] == ')':
+                k = j + 1
+                while k < n and text[k] in SPACE:
+                    k += 1
+                if k < n and text[k] == '{':
+                    result.append(text[head[0]:j + 1])
+                    i = j
+        i += 1
+        start = i
+        head = None
+    return result
+
+
+def prototypes(src):
+    """
+    Return prototypes of functions defined in a sketch, e.g.
+    ['void setup();', 'void loop();'].
+    """
+    return [p + ';' for p in find_prototypes(top_level(tokenize(src)))]
@@ -0,0 +1,118 @@
+# -*- coding: utf-8; -*-
+
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+
+from contextlib import contextmanager
+
+from ino.filters import colorize
+
+
+class Tracer(object):
+    """
+    Records start and end times of build phases and targets and exports
+    them in Chrome trace event format, viewable at chrome://tracing.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.events = []
+        self.origin = time.time()
+        self.threads = {}
+
+    def _tid(self):
+        ident = threading.current_thread().ident
+        with self.lock:
+            return self.threads.setdefault(ident, len(self.threads) + 1)
+
+    def add(self, name, category, start, end, tid=None):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int((start - self.origin) * 1e6),
+            'dur': int((end - start) * 1e6),
+            'pid': os.getpid(),
+            'tid': tid or self._tid(),
+        }
+        with self.lock:
+            self.events.append(event)
+
+    @contextmanager
+    def phase(self, name, category='phase'):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, time.time())
+
+    def load_records(self, filepath):
+        """
+        Add targets timed by the launcher (see main()) to the trace.
+        """
+        try:
+            with open(filepath) as f:
+                lines = f.readlines()
+        except IOError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            self.add(record['name'].encode('utf-8'), 'target', record['start'], record['end'],
+                     tid=record['pid'])
+
+    def dump(self, filepath):
+        with open(filepath, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self, count=10):
+        events = sorted(self.events, key=lambda ev: ev['dur'], reverse=True)[:count]
+        print colorize('Slowest steps:', 'cyan')
+        for ev in events:
+            print '%10.3fs  %-8s %s' % (ev['dur'] / 1e6, ev['cat'], ev['name'])
+
+
+# process-wide tracer, recording is cheap so it is always on
+tracer = Tracer()
+
+
+def main(argv):
+    """
+    Compiler launcher for generated Makefiles: run a compile command and
+    append its timing to a file of records as a JSON line. Make doesn't
+    report timings, so this is how targets built by make get into the
+    trace.
+
+        python -m ino.trace records.jsonl -- avr-g++ ... -o obj -c src
+    """
+    if len(argv) < 3 or argv[1] != '--':
+        sys.stderr.write('Usage: python -m ino.trace records-file -- command\n')
+        return 2
+    command = argv[2:]
+    start = time.time()
+    code = subprocess.call(command)
+    end = time.time()
+
+    source = command[-1]
+    name = os.path.join(os.path.basename(os.path.dirname(source)), os.path.basename(source))
+    line = json.dumps({'name': name, 'start': start, 'end': end, 'pid': os.getpid()}) + '\n'
+    # records of parallel jobs are appended with single writes
+    fd = os.open(argv[0], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
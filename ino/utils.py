@@ -48,6 +48,15 @@ def list_subdirs(dirname, recursive=False, exclude=[]):
     return dirs
 
 
+def user_cache_dir(*parts):
+    """
+    Return path within per-user cache directory shared by all projects,
+    i.e. ~/.cache/ino by default.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'ino', *parts)
+
+
 def format_available_options(items, head_width, head_color='cyan', 
                              default=None, default_mark="[DEFAULT]", 
                              default_mark_color='red'):
@@ -58,3 +67,17 @@ def format_available_options(items, head_width, head_color='cyan',
                            val) 
              for key, val in items]
     return '\n'.join(lines)
+
+
+def utf8_dict(d):
+    """
+    JSON object hook turning unicode strings back to byte strings used by
+    the rest of ino for paths.
+    """
+    def utf8(value):
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        if isinstance(value, list):
+            return [utf8(v) for v in value]
+        return value
+    return dict((utf8(k), utf8(v)) for k, v in d.iteritems())
@@ -0,0 +1,274 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import glob
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0x00080000
+
+
+def is_ignored(path):
+    """
+    Tell whether a path is a temporary or backup file of an editor.
+    """
+    name = os.path.basename(path)
+    return (name.startswith('.') or name.startswith('#') or name.endswith('~') or
+            name.endswith('.swp') or name.endswith('.swx') or name.isdigit())
+
+
+class InotifyWatcher(object):
+    """
+    Watches directories recursively with Linux inotify. New subdirectories
+    are watched as soon as they are created.
+    """
+
+    name = 'inotify'
+    mask = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+            IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+    def __init__(self, mask=None):
+        if mask is not None:
+            self.mask = mask
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        # AttributeError is raised here if libc has no inotify
+        self.add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.dirs = {}      # watch descriptor -> directory
+
+    def add(self, dirs, recursive=True):
+        watched = set(self.dirs.itervalues())
+        for top in dirs:
+            for dirpath, dirnames, filenames in os.walk(top):
+                if not recursive:
+                    del dirnames[:]
+                if dirpath in watched:
+                    continue
+                wd = self.add_watch(self.fd, dirpath, self.mask)
+                if wd < 0:
+                    err = ctypes.get_errno()
+                    if err == errno.ENOENT:
+                        # removed meanwhile
+                        continue
+                    raise OSError(err, '%s: %s' % (dirpath, os.strerror(err)))
+                self.dirs[wd] = dirpath
+                watched.add(dirpath)
+        self.recursive = recursive
+
+    def poll(self, timeout=None):
+        """
+        Wait up to `timeout' seconds (forever if None) for changes and
+        return a set of changed paths.
+        """
+        try:
+            ready = select.select([self.fd], [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return set()
+            raise
+        if not ready:
+            return set()
+
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip('\0')
+            offset += 16 + length
+
+            dirpath = self.dirs.get(wd)
+            if dirpath is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.dirs[wd]
+                continue
+            path = os.path.join(dirpath, name) if name else dirpath
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and self.recursive:
+                self.add([path])
+            changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """
+    Detects changes by comparing mtimes and sizes of all files in watched
+    directories every `interval' seconds. Used where inotify is not
+    available.
+    """
+
+    name = 'polling'
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.dirs = []
+        self.snapshot = {}
+        self.recursive = True
+
+    def add(self, dirs, recursive=True):
+        self.recursive = recursive
+        new_dirs = [d for d in dirs if d not in self.dirs]
+        if new_dirs:
+            self.dirs.extend(new_dirs)
+            self.snapshot.update(self.scan(new_dirs))
+
+    def scan(self, dirs):
+        result = {}
+        for top in dirs:
+            for dirpath, dirnames, filenames in os.walk(top):
+                if not self.recursive:
+                    del dirnames[:]
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    result[path] = (st.st_mtime, st.st_size)
+        return result
+
+    def poll(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = max(0, min(delay, deadline - time.time()))
+            time.sleep(delay)
+
+            current = self.scan(self.dirs)
+            paths = set(current) | set(self.snapshot)
+            changed = set(p for p in paths if current.get(p) != self.snapshot.get(p))
+            self.snapshot = current
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+
+def create_watcher(mask=None, interval=0.5):
+    """
+    Return an inotify watcher reporting events given by `mask' or, where
+    inotify is not available, one polling every `interval' seconds.
+    """
+    try:
+        return InotifyWatcher(mask)
+    except (OSError, AttributeError):
+        return PollingWatcher(interval)
+
+
+def wait_for_changes(watcher, delay):
+    """
+    Wait for changes of files which are not editor temporaries. Once
+    something changed keep collecting changes until there were none for
+    `delay' seconds, so that a burst of writes (e.g. saving several files
+    or checking out a branch) results in a single set.
+    """
+    changed = set()
+    while not changed:
+        changed = set(p for p in watcher.poll() if not is_ignored(p))
+    while True:
+        more = set(p for p in watcher.poll(delay) if not is_ignored(p))
+        if not more:
+            return changed
+        changed |= more
+
+
+class PortWatcher(object):
+    """
+    Detects serial ports appearing in the device directory, e.g. when a
+    board re-enumerates into its bootloader. A port is new if it did not
+    exist when the watcher was created or was created again since then,
+    since on Linux the bootloader often comes back with the same name.
+    Device directories are watched with inotify, so a port is noticed as
+    soon as its node appears, and polled where inotify is not available.
+
+    A port is identified by inode and device numbers of its node, which
+    unlike ctime stay the same when udev changes owner or permissions of
+    the node. With inotify a port is also known to be created again when
+    an event is reported for it, since only creation, removal and renames
+    are watched.
+    """
+
+    mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+    recheck = 0.25
+    # while a new port can't be opened yet
+    access_recheck = 0.05
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.watcher = create_watcher(self.mask, interval=0.05)
+        dirs = sorted(set(os.path.dirname(p) for p in patterns))
+        self.watcher.add([d for d in dirs if os.path.isdir(d)], recursive=False)
+        self.known = self.snapshot()
+
+    def snapshot(self):
+        """
+        Return a dict of port -> identity of its device node.
+        """
+        result = {}
+        for pattern in self.patterns:
+            for path in glob.glob(pattern):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                result[path] = (st.st_ino, st.st_rdev)
+        return result
+
+    def poll(self, timeout):
+        changed = self.watcher.poll(timeout)
+        # the polling watcher reports changed mtimes as well, e.g. of
+        # a port written to
+        if isinstance(self.watcher, InotifyWatcher):
+            for path in changed:
+                self.known.pop(path, None)
+
+    def wait(self, timeout):
+        """
+        Wait up to `timeout' seconds for a new port which could be opened
+        (udev may set its permissions a bit later than it appears).
+        Return the port or None.
+        """
+        deadline = time.time() + timeout
+        self.poll(0)
+        while True:
+            current = self.snapshot()
+            # ports gone meanwhile are new when they come back
+            for path in list(self.known):
+                if path not in current:
+                    del self.known[path]
+            new = sorted(p for p, ident in current.iteritems() if self.known.get(p) != ident)
+            for port in new:
+                if os.access(port, os.R_OK | os.W_OK):
+                    return port
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            self.poll(min(remaining, self.access_recheck if new else self.recheck))
+
+    def close(self):
+        self.watcher.close()
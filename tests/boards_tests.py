@@ -0,0 +1,84 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+from ino.boards import load_board_models, index_filepath, read_header
+
+
+boards_txt = '''\
+# comment
+uno.name=Arduino Uno
+uno.build.mcu=atmega328p
+uno.build.extra_flags=-DX=1
+
+mega.name=Arduino Mega
+mega.build.mcu=atmega2560
+'''
+
+
+class TestBoardModels(object):
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.root, 'cache')
+        self.path = os.path.join(self.root, 'boards.txt')
+        with open(self.path, 'w') as f:
+            f.write(boards_txt)
+
+    def teardown(self):
+        if self.cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.cache_home
+        shutil.rmtree(self.root)
+
+    def test_index(self):
+        load_board_models(self.path, 'uno')
+        assert os.path.exists(index_filepath(self.path))
+
+        models = load_board_models(self.path, 'uno')
+        assert_equal(models.keys(), ['uno', 'mega'])
+        assert_equal(models['uno'], {
+            'name': 'Arduino Uno',
+            'build': {'mcu': 'atmega328p', 'extra_flags': '-DX=1'},
+        })
+        assert_equal(models['mega']['build']['mcu'], 'atmega2560')
+
+    def test_changed(self):
+        load_board_models(self.path, 'uno')
+        with open(self.path, 'a') as f:
+            f.write('nano.name=Arduino Nano\n')
+        assert_equal(load_board_models(self.path, 'uno').keys(), ['uno', 'mega', 'nano'])
+
+    def test_reused_while_unchanged(self):
+        models = load_board_models(self.path, 'uno')
+        assert load_board_models(self.path, 'uno') is models
+        os.utime(self.path, (0, 0))
+        assert load_board_models(self.path, 'uno') is not models
+
+    def read_index(self):
+        with open(index_filepath(self.path), 'rb') as f:
+            return read_header(f), f.read()
+
+    def test_index_rewritten(self):
+        models = load_board_models(self.path, 'uno')
+        header, body = self.read_index()
+        # a touched boards.txt makes the next load rewrite the header
+        os.utime(self.path, (0, 0))
+        load_board_models(self.path, 'uno')
+        new_header, new_body = self.read_index()
+        assert_equal(new_header['fingerprint'], [0, len(boards_txt)])
+        assert_equal(dict(new_header, fingerprint=header['fingerprint']), header)
+        assert_equal(new_body, body)
+        assert_equal(models['mega']['build']['mcu'], 'atmega2560')
+
+    def test_latin1(self):
+        with open(self.path, 'a') as f:
+            f.write('nano.name=Arduino Nano \xe9\n')
+        models = load_board_models(self.path, 'uno')
+        assert_equal(models['nano']['name'], 'Arduino Nano \xc3\xa9')
@@ -0,0 +1,47 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from distutils.spawn import find_executable
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_equal
+
+from ino.cache import ObjectCache
+from ino.engine import Target
+
+
+class TestObjectCache(object):
+    def setup(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.cwd = os.getcwd()
+        self.cache = ObjectCache(os.path.join(self.root, 'cache'))
+        self.gcc = find_executable('gcc')
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root)
+
+    def compile(self, project):
+        project = os.path.join(self.root, project)
+        os.makedirs(os.path.join(project, 'src'))
+        with open(os.path.join(project, 'src', 'sketch.c'), 'w') as f:
+            f.write('int answer(void) { return 42; }\n')
+        os.chdir(project)
+        obj = os.path.join('src', 'sketch.o')
+        command = [self.gcc, '-g', '-O2', '-o', obj, '-c', os.path.join('src', 'sketch.c')]
+        assert_equal(self.cache.compile(Target(obj, [], command))[0], 0)
+        with open(obj, 'rb') as f:
+            return f.read()
+
+    def test_shared_between_projects_with_debug_info(self):
+        if not self.gcc:
+            raise SkipTest('gcc is not available')
+        self.compile('a')
+        obj = self.compile('b')
+        assert_equal((self.cache.hits, self.cache.misses), (1, 1))
+        # DW_AT_comp_dir doesn't point at the project the object was
+        # compiled in first
+        assert os.path.join(self.root, 'a') not in obj
@@ -0,0 +1,12 @@
+# -*- coding: utf-8; -*-
+
+from nose.tools import assert_equal
+
+import ino.commands
+
+
+class TestRegistry(object):
+    def test_matches_command_classes(self):
+        for info in ino.commands.registry:
+            cls = info.load()
+            assert_equal((cls.name, cls.help_line), (info.name, info.help_line))
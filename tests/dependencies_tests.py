@@ -0,0 +1,186 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+from ino.dependencies import IncludeScanner, HeaderIndex, DependencyGraph, toposort
+
+
+class TestToposort(object):
+    def test_dependencies_go_after_dependants(self):
+        graph = {
+            'Ethernet': ['SPI', 'arduino'],
+            'SPI': ['arduino'],
+            'Servo': ['arduino'],
+        }
+        assert_equal(toposort(graph, ['SPI', 'Ethernet', 'Servo']),
+                     ['Ethernet', 'SPI', 'Servo', 'arduino'])
+
+    def test_independent_keep_order(self):
+        assert_equal(toposort({}, ['b', 'a', 'c']), ['b', 'a', 'c'])
+
+    def test_cycle_keeps_discovery_order(self):
+        graph = {'a': ['b'], 'b': ['c'], 'c': ['a']}
+        assert_equal(toposort(graph, ['a']), ['a', 'b', 'c'])
+        graph = {'x': ['b'], 'a': ['b'], 'b': ['a']}
+        assert_equal(toposort(graph, ['x']), ['x', 'b', 'a'])
+
+
+class TestIncludeScanner(object):
+    def test_comments_and_strings(self):
+        src = '\n'.join([
+            '#include <A.h>',
+            '/* disabled:',
+            '#include <B.h>',
+            '*/',
+            '// #include <C.h>',
+            'const char *s = "#include <D.h>";',
+            '  #  include "E.h" // comment',
+        ])
+        assert_equal(IncludeScanner().parse(src),
+                     [('<', 'A.h', False), ('"', 'E.h', False)])
+
+    def test_constant_conditions(self):
+        src = '\n'.join([
+            '#if 0',
+            '#include <A.h>',
+            '#ifdef X',
+            '#include <B.h>',
+            '#else',
+            '#include <C.h>',
+            '#endif',
+            '#else',
+            '#include <D.h>',
+            '#endif',
+            '#if 1 // always',
+            '#include <E.h>',
+            '#elif defined(Y)',
+            '#include <F.h>',
+            '#endif',
+            '#ifdef Z',
+            '#include <G.h>',
+            '#endif',
+        ])
+        assert_equal(IncludeScanner().parse(src),
+                     [('<', 'D.h', False), ('<', 'E.h', False), ('<', 'G.h', True)])
+
+    def test_macros(self):
+        src = '\n'.join([
+            '#ifndef SKETCH_H',
+            '#define SKETCH_H',
+            '#define USE_A',
+            '#ifdef USE_A',
+            '#include <A.h>',
+            '#endif',
+            '#ifdef USE_FOO',
+            '#include <Foo.h>',
+            '#endif',
+            '#if ARDUINO >= 100',
+            '#include "Arduino.h"',
+            '#else',
+            '#include "WProgram.h"',
+            '#endif',
+            '#if !defined(F_CPU) || F_CPU > 8000000',
+            '#include <B.h>',
+            '#endif',
+            '#ifdef SKETCH_H',
+            '#include <C.h>',
+            '#endif',
+            '#endif',
+        ])
+        scanner = IncludeScanner(defines={'ARDUINO': '105', 'F_CPU': '16000000L'})
+        assert_equal(scanner.parse(src), [
+            ('<', 'A.h', False),
+            ('<', 'Foo.h', True),
+            ('"', 'Arduino.h', False),
+            ('<', 'B.h', True),
+            ('<', 'C.h', False),
+        ])
+
+
+class TestOptionalLibraries(object):
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+        files = {
+            'src/sketch.cpp': '#include <Arduino.h>\n#include <Bar.h>\n'
+                              '#ifdef USE_FOO\n#include <Foo.h>\n#endif\n',
+            'core/Arduino.h': '',
+            'libs/Bar/Bar.h': '#if ARDUINO >= 100\n#include <Arduino.h>\n#endif\n',
+            'libs/Bar/Bar.cpp': '#include "Bar.h"\n',
+            'libs/Foo/Foo.h': '#include <Baz.h>\n',
+            'libs/Foo/Foo.cpp': '#include "Foo.h"\n',
+            'libs/Baz/Baz.h': '',
+        }
+        for path, contents in files.iteritems():
+            path = os.path.join(self.root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(contents)
+        self.dir = lambda *parts: os.path.join(self.root, *parts)
+
+    def teardown(self):
+        shutil.rmtree(self.root)
+
+    def test_conditional_library_is_optional(self):
+        lib_dirs = [self.dir('core')] + [self.dir('libs', l) for l in ['Bar', 'Baz', 'Foo']]
+        graph = DependencyGraph(lib_dirs, lib_dirs)
+        sources_of = lambda d: [os.path.join(d, f) for f in os.listdir(d) if f.endswith('.cpp')]
+        used = graph.scan(self.dir('src'), sources_of)
+        # the core goes after Bar including it within #if
+        assert_equal(used, [self.dir('libs', 'Bar'), self.dir('core')])
+        # so are libraries included by optional ones
+        assert_equal(graph.optional_libs, [self.dir('libs', 'Foo'), self.dir('libs', 'Baz')])
+        # Foo.h is found if USE_FOO is defined, Baz.h is found by Foo.h
+        assert_equal(graph.include_dirs([self.dir('src', 'sketch.cpp')]),
+                     set(lib_dirs))
+
+
+class TestHeaderIndex(object):
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+        for path in ['a/x.h', 'b/x.h', 'b/utility/y.h']:
+            path = os.path.join(self.root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+        self.dirs = [os.path.join(self.root, d) for d in ['a', 'b', 'b/utility']]
+
+    def teardown(self):
+        shutil.rmtree(self.root)
+
+    def test_first_dir_wins(self):
+        a = self.dirs[0]
+        assert_equal(HeaderIndex().find(self.dirs, 'x.h'), (os.path.join(a, 'x.h'), a))
+
+    def test_subdirectory(self):
+        b = self.dirs[1]
+        assert_equal(HeaderIndex().find(self.dirs, 'utility/y.h'),
+                     (os.path.join(b, 'utility', 'y.h'), b))
+        assert_equal(HeaderIndex().find(self.dirs, 'utility/x.h'), None)
+
+    def test_listing_is_refreshed(self):
+        index = HeaderIndex()
+        assert_equal(index.find(self.dirs, 'z.h'), None)
+        open(os.path.join(self.dirs[1], 'z.h'), 'w').close()
+        # make sure mtime of the directory changes
+        os.utime(self.dirs[1], (0, 0))
+        assert_equal(index.find(self.dirs, 'z.h')[1], self.dirs[1])
+
+    def test_relative_paths_of_projects(self):
+        index = HeaderIndex()
+        cwd = os.getcwd()
+        try:
+            # `a' and `b' with the same mtime stand for `lib' of two projects
+            os.utime(self.dirs[0], (0, 0))
+            os.utime(self.dirs[1], (0, 0))
+            os.chdir(self.dirs[0])
+            assert_equal(index.listing('.'), (['x.h'], []))
+            os.chdir(self.dirs[1])
+            assert_equal(index.listing('.'), (['x.h'], ['utility']))
+        finally:
+            os.chdir(cwd)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_raises
+
+from ino.engine import Engine, Target
+from ino.exc import Abort
+
+
+class TestEngine(object):
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.root)
+
+    def test_failed_target_is_deleted(self):
+        path = os.path.join(self.root, 'partial.o')
+
+        def runner(target):
+            with open(target.path, 'w') as f:
+                f.write('partial')
+            return 1, 'error'
+
+        engine = Engine()
+        engine.report = lambda target, code, output: None
+        assert_raises(Abort, engine.build, [Target(path, [], runner=runner)])
+        assert not os.path.exists(path)
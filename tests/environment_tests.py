@@ -1,8 +1,16 @@
 # -*- coding: utf-8; -*-
 
-from nose.tools import assert_equal
+import os
+import os.path
+import shutil
+import tempfile
 
-from ino.environment import Version
+from argparse import Namespace
+
+from nose.tools import assert_equal, assert_is_none, assert_raises
+
+from ino.environment import Environment, SearchCache, Version
+from ino.exc import Abort
 
 
 class TestVersion(object):
@@ -11,3 +19,110 @@ class TestVersion(object):
         assert_equal(Version.parse('0022ubuntu0.1'), (0, 22))
         assert_equal(Version.parse('0022-macosx-20110822'), (0, 22))
         assert_equal(Version.parse('1.0'), (1, 0))
+
+
+class TestDiscoveryCache(object):
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+        self.boards_txt = os.path.join(self.root, 'boards.txt')
+        with open(self.boards_txt, 'w') as f:
+            f.write('uno.name=Arduino Uno\n')
+
+        e = Environment()
+        e.output_dir = self.root
+        e.remember('boards.txt', self.boards_txt, ['places'], [self.boards_txt])
+        e.dump()
+
+        self.e = Environment()
+        self.e.output_dir = self.root
+        self.e.load()
+
+    def teardown(self):
+        shutil.rmtree(self.root)
+
+    def test_valid(self):
+        assert_equal(self.e.cached('boards.txt', ['places']), self.boards_txt)
+        assert_equal(self.e['boards.txt'], self.boards_txt)
+
+    def test_other_places(self):
+        assert_is_none(self.e.cached('boards.txt', ['elsewhere']))
+
+    def test_changed_file(self):
+        with open(self.boards_txt, 'a') as f:
+            f.write('uno.upload.speed=115200\n')
+        assert_is_none(self.e.cached('boards.txt', ['places']))
+
+    def test_copies_share_changes(self):
+        copy = Environment(self.e)
+        copy.remember('make_output_sync', True, ['PATH'])
+        self.e.dump()
+        e = Environment()
+        e.output_dir = self.root
+        e.load()
+        assert e.cached('make_output_sync', ['PATH'])
+
+    def test_missing_until_found(self):
+        find = lambda: self.e.find_file('gcc_ar', ['avr-gcc-ar'], [self.root])
+        assert_raises(Abort, find)
+        assert self.e.cached('gcc_ar:missing', [['avr-gcc-ar'], [self.root], True])
+        tool = os.path.join(self.root, 'avr-gcc-ar')
+        open(tool, 'w').close()
+        assert_equal(find(), tool)
+
+
+class TestProfiles(object):
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.root)
+
+    def process_args(self, **kwargs):
+        e = Environment()
+        e.output_dir = self.root
+        e.process_args(Namespace(board_model=None, **kwargs))
+        return e
+
+    def test_upload_uses_last_built_profile(self):
+        upload = self.process_args(profile=None)
+        assert_equal(upload.build_dir, os.path.join(self.root, 'uno'))
+
+        build = self.process_args(profile='size')
+        assert_equal(build.build_dir, os.path.join(self.root, 'uno-size'))
+        build.remember_profiles()
+
+        upload = self.process_args(profile=None)
+        assert_equal(upload.build_dir, os.path.join(self.root, 'uno-size'))
+        upload = self.process_args(profile='default')
+        assert_equal(upload.build_dir, os.path.join(self.root, 'uno'))
+
+    def test_commands_without_profile(self):
+        self.process_args(profile='speed').remember_profiles()
+        assert_equal(self.process_args().build_dir, os.path.join(self.root, 'uno'))
+
+
+class TestSearchCache(object):
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = self.root
+
+    def teardown(self):
+        if self.cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.cache_home
+        shutil.rmtree(self.root)
+
+    def test_shared_until_gone(self):
+        tool = os.path.join(self.root, 'avr-gcc')
+        open(tool, 'w').close()
+        key = [['avr-gcc'], [self.root], True]
+        cache = SearchCache()
+        assert_is_none(cache.get(key))
+        cache.set(key, tool)
+        cache.dump()
+
+        assert_equal(SearchCache().get(key), tool)
+        os.remove(tool)
+        assert_is_none(SearchCache().get(key))
@@ -0,0 +1,22 @@
+# -*- coding: utf-8; -*-
+
+from nose.tools import assert_equal
+
+from ino.engine import Target
+from ino.explain import Explainer
+
+
+class TestExplainer(object):
+    def test_root_causes(self):
+        obj = Target('a.o', ['a.c', 'a.h'])
+        other = Target('b.o', ['b.c'])
+        elf = Target('firmware.elf', [obj, other])
+
+        explainer = Explainer()
+        explainer.add(obj, ('changed', 'a.h'), 1.0)
+        explainer.add(other, ('command', (('-O2',), ('-Os',))), 2.0)
+        explainer.add(elf, ('newer', 'a.o'), 0.5)
+        assert_equal(explainer.causes(), [
+            ('flags changed: added -O2; removed -Os', 1, 2.0),
+            ('a.h changed', 2, 1.5),
+        ])
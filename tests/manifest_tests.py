@@ -0,0 +1,52 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_true, assert_false
+
+from ino.engine import Target
+from ino.manifest import Manifests
+
+
+class TestManifests(object):
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+        self.source = os.path.join(self.root, 'a.c')
+        self.write(self.source, 'int a;')
+        self.target = Target(os.path.join(self.root, 'a.o'), [self.source], ['cc', '-c', 'a.c'])
+        self.write(self.target.path, 'obj')
+        self.manifests = Manifests(self.root)
+        self.manifests.record(self.target)
+
+    def teardown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_touch_keeps_current(self):
+        os.utime(self.source, (0, 0))
+        assert_true(self.manifests.is_current(self.target))
+
+    def test_changes(self):
+        self.manifests.dump()
+        manifests = Manifests(self.root)
+        manifests.load()
+        assert_true(manifests.is_current(self.target))
+
+        self.target.command = ['cc', '-O2', '-c', 'a.c']
+        assert_false(manifests.is_current(self.target))
+        self.target.command = ['cc', '-c', 'a.c']
+
+        self.write(self.source, 'int b;;')
+        assert_false(manifests.is_current(self.target))
+
+    def test_explain(self):
+        self.target.command = ['cc', '-O2', '-c', 'a.c']
+        assert_equal(self.manifests.explain(self.target), ('command', (('-O2',), ())))
+        self.write(self.source, 'int b;;')
+        assert_equal(self.manifests.explain(self.target), ('changed', self.source))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8; -*-
+
+import os.path
+
+from glob import glob
+
+from nose.tools import assert_equal
+
+from ino.sketch import prototypes, tokenize
+from ino.commands.preproc import Preprocess
+
+
+corpus_dir = os.path.join(os.path.dirname(__file__), 'sketches')
+
+
+def check_prototypes(sketch_path):
+    with open(sketch_path) as f:
+        sketch = f.read()
+    with open(os.path.splitext(sketch_path)[0] + '.prototypes') as f:
+        expected = f.read()
+    assert_equal(''.join(p + '\n' for p in prototypes(sketch)), expected)
+
+
+def test_corpus():
+    for sketch_path in sorted(glob(os.path.join(corpus_dir, '*.ino'))):
+        yield check_prototypes, sketch_path
+
+
+class TestTokenize(object):
+    def test_kinds(self):
+        src = '#include <a.h>\nint x = \'{\'; // }\nchar *s = R"(")"; int y = 1\'000;'
+        assert_equal(list(tokenize(src)), [
+            ('directive', '#include <a.h>'),
+            ('code', '\nint x = '), ('char', "'{'"), ('code', '; '),
+            ('comment', '// }'),
+            ('code', '\nchar *s = '), ('raw', 'R"(")"'), ('code', "; int y = 1'000;"),
+        ])
+
+    def test_hash_in_line(self):
+        assert_equal(list(tokenize('a # b\n  #x')),
+                     [('code', 'a # b'), ('other', '\n'), ('directive', '  #x')])
+
+    def test_not_raw(self):
+        assert_equal(list(tokenize('print(R"alarm");')),
+                     [('code', 'print(R'), ('string', '"alarm"'), ('code', ');')])
+        assert_equal(list(tokenize('R"a delimiter of 17 chars(")"')),
+                     [('code', 'R'), ('string', '"a delimiter of 17 chars("'),
+                      ('code', ')'), ('string', '"')])
+
+    def test_unterminated(self):
+        assert_equal(prototypes('void f() {}\n/* void g() {}'), ['void f();'])
+        assert_equal(prototypes('char *s = "{;\nvoid f() {}'), ['void f();'])
+
+
+class ArduinoPreprocess(Preprocess):
+    header = 'Arduino.h'
+
+
+class TestCombine(object):
+    def test_single(self):
+        preproc = ArduinoPreprocess(None)
+        assert_equal(preproc.preprocess('void setup() {}\n', 'src/a.ino'),
+                     preproc.combine([('src/a.ino', 'void setup() {}\n')]))
+
+    def test_tabs(self):
+        source = ArduinoPreprocess(None).combine([
+            ('src/a.ino', 'void setup() { f(); }'),
+            ('src/b.ino', 'int f() { return 1; }\n'),
+        ])
+        assert_equal(source, '#include <Arduino.h>\n'
+                             'void setup();\n'
+                             'int f();\n'
+                             '#line 1 "src/a.ino"\n'
+                             'void setup() { f(); }\n'
+                             '#line 1 "src/b.ino"\n'
+                             'int f() { return 1; }\n')
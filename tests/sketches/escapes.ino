@@ -0,0 +1,26 @@
+// Literals and continuations the former regex based implementation got
+// wrong: it didn't know escapes in character literals, raw strings and
+// continuation lines of comments and preprocessor directives.
+
+char quote = '\"';
+char apostrophe = '\'';
+char backslash = '\\';
+
+void afterChars() {}
+
+const char *json = R"({"key": "value"})";
+const char *braces = R"x(} ) " {)x";
+
+void afterRawStrings() {}
+
+// a comment continued on the next line \
+void commented() {}
+
+#define OPEN_BLOCK { \
+  int unused;
+
+void afterDirective() {}
+
+const char *path = "C:\\";
+
+void afterString() {}
@@ -0,0 +1,18 @@
+// braces and parentheses in literals and comments must not confuse
+// the preprocessor: void commented(int x) {
+const char *open = "{ not a block (";
+const char *close = "} \" still a string {";
+char brace = '{';
+char quote = '"';
+
+/* a block comment with a fake definition
+void fake(int a) {
+}
+*/
+
+void printBraces() {
+  Serial.print('}');
+  Serial.print("}}}");
+}
+
+int afterLiterals(int a) { return a; }
@@ -0,0 +1,26 @@
+#include "config.h"
+#if defined(ARDUINO) && ARDUINO >= 100
+  #include "Arduino.h"
+#else
+  #include "WProgram.h"
+#endif
+
+#define LONG_MACRO(x) \
+  do { \
+    (x)++; \
+  } while (0)
+
+#ifdef DEBUG
+void debug(const char *message) {
+  Serial.println(message);
+}
+#endif
+
+void setup() {
+#if DEBUG
+  debug("setup");
+#endif
+}
+
+void loop() {
+}
@@ -0,0 +1,12 @@
+// R is a macro here, so R"..." is not a raw string literal
+#define R "\033[31m"
+
+void setup() {
+  Serial.print(R"alarm");
+}
+
+void alarm(int level) {
+  Serial.print(R"{");
+}
+
+void loop() {}
@@ -0,0 +1,49 @@
+#include <Servo.h>
+#define LED 13
+#define MAX(a, b) ((a) > (b) ? (a) : (b))
+
+Servo servo;
+static int counter = 0;
+const char *names[] = {"one", "two", "three"};
+
+void setup()
+{
+  Serial.begin(9600);
+}
+
+void loop() {
+  blink(LED, 100);
+}
+
+static void blink(int pin, unsigned long ms) {
+  digitalWrite(pin, HIGH);
+  delay(ms);
+  digitalWrite(pin, LOW);
+}
+
+unsigned long long
+multiline(int a,
+          int b)
+{
+  return a * b;
+}
+
+char *copy(char *dst, const char *src) {
+  return strcpy(dst, src);
+}
+
+int &ref(int &value) { return value; }
+
+float average(float values[], int count) {
+  float sum = 0;
+  for (int i = 0; i < count; i++) {
+    if (values[i] > 0) {
+      sum += values[i];
+    }
+  }
+  return sum / count;
+}
+
+inline byte high(word w) { return w >> 8; }
+
+void noArgs(void) {}
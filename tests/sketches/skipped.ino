@@ -0,0 +1,25 @@
+// Definitions which are not given prototypes: methods, parameters
+// with default values and function-like macros
+
+struct Point {
+  int x, y;
+  int sum() { return x + y; }
+};
+
+class Counter {
+public:
+  void increment() { count++; }
+private:
+  int count;
+};
+
+void Counter_reset(Counter &c) {}
+
+void withDefault(int a = 1) {}
+
+int Point_sum(Point p) { return p.x + p.y; }
+
+#define DEFINE_HANDLER(name) void name() { }
+
+void setup() {}
+void loop() {}
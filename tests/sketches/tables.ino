@@ -0,0 +1,24 @@
+#include <avr/pgmspace.h>
+
+const unsigned char font[] PROGMEM = {
+  0x00, 0x00, 0x00, 0x00, 0x00,
+  0x3E, 0x5B, 0x4F, 0x5B, 0x3E,
+  0x3E, 0x6B, 0x4F, 0x6B, 0x3E,
+  0x1C, 0x3E, 0x7C, 0x3E, 0x1C,
+};
+
+struct Note { int pitch; int duration; };
+
+Note melody[] = {
+  {262, 4}, {196, 8}, {196, 8}, {220, 4},
+};
+
+int lookup(int index) {
+  return pgm_read_byte(&font[index]);
+}
+
+void play(Note *notes, int count) {
+  for (int i = 0; i < count; i++) {
+    tone(8, notes[i].pitch, 1000 / notes[i].duration);
+  }
+}
@@ -0,0 +1,44 @@
+# -*- coding: utf-8; -*-
+
+import os
+import os.path
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_is_none
+
+from ino.watch import PortWatcher
+
+
+class TestPortWatcher(object):
+    def setup(self):
+        self.dev_dir = tempfile.mkdtemp()
+        self.touch('ttyACM0')
+        self.watcher = PortWatcher([os.path.join(self.dev_dir, 'ttyACM*')])
+
+    def teardown(self):
+        self.watcher.close()
+        shutil.rmtree(self.dev_dir)
+
+    def touch(self, name):
+        path = os.path.join(self.dev_dir, name)
+        open(path, 'w').close()
+        return path
+
+    def test_existing_port(self):
+        assert_is_none(self.watcher.wait(0.1))
+
+    def test_new_port(self):
+        port = self.touch('ttyACM1')
+        assert_equal(self.watcher.wait(1), port)
+
+    def test_recreated_port(self):
+        os.remove(os.path.join(self.dev_dir, 'ttyACM0'))
+        port = self.touch('ttyACM0')
+        assert_equal(self.watcher.wait(1), port)
+
+    def test_changed_attributes(self):
+        port = os.path.join(self.dev_dir, 'ttyACM0')
+        os.chmod(port, 0600)
+        os.chown(port, os.getuid(), os.getgid())
+        assert_is_none(self.watcher.wait(0.1))